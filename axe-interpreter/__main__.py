@@ -40,25 +40,44 @@ def main(args=None):
     else:
         options = console_parser.parse()
         
+    choice = options.test
+    
+    # The interpreter reads the file as it goes, instead of all at once.
+    input_file = None
+    text = ''
     if options.input_path:
         try:
-            with open(options.input_path, 'r') as input_file:
-                text = input_file.read()
+            input_file = open(options.input_path, 'r')
         except IOError:
             error = "\nERROR: Could not open or find `{0}`.  Starting interpreter mode.\n"
             print(error.format(options.input_path))
-            text = ''
-    else:
-        text = ''
-    
-    choice = options.test
+        else:
+            if choice != 'interpreter':
+                with input_file:
+                    text = input_file.read()
+                input_file = None
     
     if choice == 'lexer':
         axe.lexer.test(text)
     elif choice == 'parser':
         axe.parser.test(text)
     elif choice == 'interpreter':
-        axe.interpreter.test(text=text)
+        if options.headless:
+            calculator = axe.calculator.HeadlessCalculator(
+                memory_file=options.memory_file)
+        else:
+            calculator = axe.calculator.Calculator(
+                dither=options.dither, memory_file=options.memory_file)
+        if options.no_cache:
+            cache = None
+        else:
+            cache = axe.cache.ParseCache()
+        axe.interpreter.test(text=text, calculator=calculator, 
+                             backend=axe.backends[options.backend],
+                             profile=options.profile, cache=cache,
+                             source=input_file)
+        if input_file:
+            input_file.close()
     return
 
 # Testing harness below (too lazy to bundle properly)
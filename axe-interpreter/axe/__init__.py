@@ -10,22 +10,36 @@ License: GNU Lesser GPL
 
 ## Program Modules ##
 import axe.lexer
+import axe.tokenizer
 import axe.parser
+import axe.cache
+import axe.optimizer
+import axe.registers
 import axe.interpreter
+import axe.jit
+import axe.bytecode
+import axe.codegen
 import axe.calculator
 from meta import *
+
+backends = {
+    'closure': axe.interpreter.Interpreter,
+    'bytecode': axe.bytecode.BytecodeInterpreter,
+    'python': axe.codegen.PythonInterpreter
+}
     
 class Axe():
-    def __init__(self):
+    def __init__(self, backend='closure'):
         self.lexer = axe.lexer.build()
         self.parser = axe.parser.build()
         self.calculator = axe.calculator.Calculator()
-        self.interpreter = axe.interpreter.Interpreter(self.calculator)
+        self.interpreter = backends[backend](self.calculator)
         return
     
     def run(self, text=''):
         self.calculator.init()
         ast = self.parser.parse(text, lexer=self.lexer)
+        ast = axe.optimizer.optimize(ast)
         return self.interpreter.execute(ast)
 
 if __name__ == '__main__':
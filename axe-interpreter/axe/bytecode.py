@@ -0,0 +1,631 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+from __future__ import print_function
+import array
+import operator
+import os.path
+import random
+import time
+import webbrowser
+
+import axe.parser
+import axe.interpreter
+
+class CompileError(axe.interpreter.AxeRuntimeError):
+    """The ast contains a node the bytecode compiler can't handle."""
+    pass
+
+class InvalidJumpError(axe.interpreter.AxeRuntimeError):
+    """A computed goto is jumping somewhere that isn't a label."""
+    pass
+
+
+## Opcodes ##
+
+# Every instruction is one opcode plus one integer argument.  What the
+# argument means depends on the opcode -- a literal number, a memory address,
+# an instruction index, or an index into one of the operand tables.
+#
+# The numbering is roughly in order of how often the opcodes show up in the
+# middle of a loop, which is also the order the dispatch loop tests them in.
+
+LOAD2_AT = 0        # push the 2-byte var at address 'arg'
+PUSH = 1            # push 'arg'
+STORE2_AT = 2       # pop value, store 2 bytes at address 'arg', push value
+POP = 3             # pop and discard (end of a line)
+ADD = 4
+SUB = 5
+MUL = 6
+ADD_CONST = 7       # add 'arg' to the top of the stack
+BINARY = 8          # pop b, pop a, push binary_ops[arg](a, b)
+JUMP = 9
+JUMP_IF_FALSE = 10  # pop; jump to 'arg' if zero
+JUMP_IF_TRUE = 11   # pop; jump to 'arg' if nonzero
+JUMP_IF_GT = 12     # pop b, pop a; jump to 'arg' if a > b
+LOAD1_AT = 13
+STORE1_AT = 14
+LOAD1 = 15          # pop address, push 1-byte var
+LOAD2 = 16          # pop address, push 2-byte var
+STORE1 = 17         # pop address, pop value, store, push value
+STORE2 = 18
+ADD_TO2_AT = 19     # pop increment, add it to the 2-byte var at 'arg'
+ADD_TO2 = 20        # pop address, pop increment, add to the 2-byte var
+CALL = 21           # call natives[arg], see Bytecode.add_native
+JUMP_DYNAMIC = 22   # pop a label address and jump to it
+
+OPCODE_NAMES = dict(
+    (value, name) for (name, value) in globals().items()
+    if name.isupper() and type(value) == int)
+
+
+def constant(ast):
+    """Returns the value of an expression if it's known at compile time,
+    or None."""
+    if type(ast) == int:
+        return ast
+    if type(ast) == axe.parser.Expression:
+        if type(ast.value) == int:
+            return ast.value
+        return None
+    if isinstance(ast, axe.parser.Operation):
+        return ast.resolve()
+    return None
+
+
+class Bytecode(object):
+    """
+    A compiled program: flat arrays of opcodes and arguments, plus the
+    operand tables they index into.
+    """
+    def __init__(self):
+        self.ops = array.array('B')
+        self.args = array.array('l')
+        self.binary_ops = []
+        self.natives = []
+        self.labels = {}
+        self.fixups = []
+        return
+
+    def __len__(self):
+        return len(self.ops)
+
+    def emit(self, op, arg=0):
+        self.ops.append(op)
+        self.args.append(arg)
+        return len(self.ops) - 1
+
+    def patch(self, index, arg):
+        self.args[index] = arg
+        return
+
+    def add_binary_op(self, function):
+        if function not in self.binary_ops:
+            self.binary_ops.append(function)
+        return self.binary_ops.index(function)
+
+    def add_native(self, function, argc):
+        """
+        Adds a Python function to the native table and returns its index.
+
+        When called, the function is given the top 'argc' values of the stack
+        (in the order they were pushed) and its return value is pushed.
+        """
+        self.natives.append((function, argc))
+        return len(self.natives) - 1
+
+    def add_label(self, name):
+        self.labels[name] = len(self.ops)
+        return
+
+    def add_fixup(self, index, name):
+        """Marks the argument of an instruction to be filled with the
+        location of a label once every label is known."""
+        self.fixups.append((index, name))
+        return
+
+    def link(self):
+        for index, name in self.fixups:
+            if name not in self.labels:
+                raise axe.interpreter.MissingLabelException(
+                    'Missing label: ' + str(name))
+            self.patch(index, self.labels[name])
+        self.fixups = []
+        self.jump_targets = frozenset(self.labels.values())
+        return
+
+    def disassemble(self):
+        output = []
+        targets = dict((v, k) for (k, v) in self.labels.items())
+        for index in xrange(len(self.ops)):
+            if index in targets:
+                output.append('Lbl ' + targets[index] + ':')
+            name = OPCODE_NAMES[self.ops[index]]
+            output.append('  {0:>4} {1:<14} {2}'.format(
+                index, name, self.args[index]))
+        return '\n'.join(output)
+
+
+class Compiler(object):
+    """
+    Turns an abstract syntax tree (see 'axe/parser.py') into Bytecode.
+
+    Every expression compiles to code which leaves exactly one value on the
+    stack.  Lines pop that value back off once they're done.
+    """
+    def __init__(self, calculator):
+        self.calculator = calculator
+        return
+
+    def compile(self, ast):
+        bytecode = Bytecode()
+        self.emit(bytecode, ast)
+        bytecode.link()
+        return bytecode
+
+    def emit(self, code, ast):
+        if not ast:
+            return
+        try:
+            method = getattr(self, '_' + ast.name)
+        except AttributeError:
+            raise CompileError('Cannot compile: ' + str(ast.name))
+        method(code, ast)
+        return
+
+    def emit_native(self, code, function, *args):
+        for arg in args:
+            self.emit(code, arg)
+        code.emit(CALL, code.add_native(function, len(args)))
+        return
+
+    ### System components ###
+
+    def _program(self, code, ast):
+        for subtree in ast.children:
+            self.emit(code, subtree)
+        return
+
+    def _block(self, code, ast):
+        for subtree in ast.children:
+            if subtree and subtree.name in ('horizontal', 'vertical'):
+                # The closure engine never appends these either.
+                continue
+            self.emit(code, subtree)
+        return
+
+    def _line(self, code, ast):
+        line = ast.children[0]
+        self.emit(code, line)
+        if line.name not in ('label', 'goto'):
+            code.emit(POP)
+        return
+
+    ### Numerical components ###
+
+    def _expression(self, code, ast):
+        if type(ast.value) == int:
+            code.emit(PUSH, ast.value)
+        else:
+            self.emit(code, ast.value)
+        return
+
+    def _operation(self, code, ast):
+        self.emit(code, ast.args[0])
+        for arg in ast.args[1:]:
+            value = constant(arg)
+            if value is not None and ast.op in ('add', 'sub'):
+                if ast.op == 'sub':
+                    value = -value
+                code.emit(ADD_CONST, value)
+                continue
+            self.emit(code, arg)
+            if ast.op == 'add':
+                code.emit(ADD)
+            elif ast.op == 'sub':
+                code.emit(SUB)
+            elif ast.op == 'mul':
+                code.emit(MUL)
+            else:
+                code.emit(BINARY, code.add_binary_op(getattr(operator, ast.op)))
+        return
+
+    ### Pointers and assignment ###
+
+    def _assignment(self, code, ast):
+        self.emit(code, ast.value)
+        address = constant(ast.pointer.address)
+        size = ast.pointer.size
+        if address is not None:
+            code.emit(STORE1_AT if size == 1 else STORE2_AT, address)
+        else:
+            self.emit(code, ast.pointer.address)
+            code.emit(STORE1 if size == 1 else STORE2)
+        return
+
+    def _pointer(self, code, ast):
+        address = constant(ast.address)
+        if address is not None:
+            code.emit(LOAD1_AT if ast.size == 1 else LOAD2_AT, address)
+        else:
+            self.emit(code, ast.address)
+            code.emit(LOAD1 if ast.size == 1 else LOAD2)
+        return
+
+    def _dereference(self, code, ast):
+        self.emit(code, ast.children[0].address)
+        return
+
+    ### Control structures ###
+
+    def _while(self, code, ast):
+        s_start = len(code)
+        self.emit(code, ast.children['condition'])
+        s_check = code.emit(JUMP_IF_FALSE)
+        self.emit(code, ast.children['body'])
+        code.emit(JUMP, s_start)
+        code.patch(s_check, len(code))
+        return
+
+    def _repeat(self, code, ast):
+        s_start = len(code)
+        self.emit(code, ast.children['condition'])
+        s_check = code.emit(JUMP_IF_TRUE)
+        self.emit(code, ast.children['body'])
+        code.emit(JUMP, s_start)
+        code.patch(s_check, len(code))
+        return
+
+    def _for(self, code, ast):
+        # initialize loop variable
+        # label TOP: if var > end, jump to label EXIT
+        #     body
+        #     var += increment
+        #     jump to label TOP
+        # label EXIT
+        pointer = ast.children['pointer']
+        address = constant(pointer.address)
+
+        self.emit(code, axe.parser.Assignment(
+            value=ast.children['start'], pointer=pointer))
+        code.emit(POP)
+
+        s_start = len(code)
+        self.emit(code, pointer)
+        self.emit(code, ast.children['end'])
+        s_check = code.emit(JUMP_IF_GT)
+
+        self.emit(code, ast.children['body'])
+
+        self.emit(code, ast.children['increment'])
+        if address is not None and pointer.size == 2:
+            code.emit(ADD_TO2_AT, address)
+        elif pointer.size == 2:
+            self.emit(code, pointer.address)
+            code.emit(ADD_TO2)
+        else:
+            self.emit(code, pointer)
+            code.emit(ADD)
+            self.emit(code, pointer.address)
+            code.emit(STORE1)
+            code.emit(POP)
+        code.emit(JUMP, s_start)
+        code.patch(s_check, len(code))
+        return
+
+    def _if(self, code, ast):
+        self.emit(code, ast.children['condition'])
+        s_check = code.emit(JUMP_IF_FALSE)
+        self.emit(code, ast.children['body'])
+        code.patch(s_check, len(code))
+        return
+
+    def _if_else(self, code, ast):
+        self.emit(code, ast.children['condition'])
+        s_check = code.emit(JUMP_IF_FALSE)
+        self.emit(code, ast.children['body'].children[0])
+        s_jump = code.emit(JUMP)
+        code.patch(s_check, len(code))
+        self.emit(code, ast.children['body'].children[1])
+        code.patch(s_jump, len(code))
+        return
+
+    def _label(self, code, ast):
+        code.add_label(ast.children['target'])
+        return
+
+    def _goto(self, code, ast):
+        target = ast.children['target']
+        if isinstance(target, basestring):
+            code.add_fixup(code.emit(JUMP), target)
+        else:
+            self.emit(code, target)
+            code.emit(JUMP_DYNAMIC)
+        return
+
+    def _get_label(self, code, ast):
+        code.add_fixup(code.emit(PUSH), ast.children[0])
+        return
+
+    ### Drawing ###
+
+    def pxl_commands(self, code, ast, drawing_func):
+        def pxl(buf, x, y):
+            drawing_func(buf, (x, y), (1, 1))
+            return 1
+        self.emit_native(code, pxl, ast.buf.address, ast.start_x, ast.start_y)
+        return
+
+    def _pxl_on(self, code, ast):
+        return self.pxl_commands(code, ast, self.calculator.rect)
+
+    def _pxl_off(self, code, ast):
+        return self.pxl_commands(code, ast, self.calculator.clear_rect)
+
+    def _pxl_change(self, code, ast):
+        return self.pxl_commands(code, ast, self.calculator.inverse_rect)
+
+    def _pxl_test(self, code, ast):
+        pxl_get = self.calculator.pxl_get
+        def pxl_test(buf, x, y):
+            return pxl_get(buf, (x, y))
+        self.emit_native(
+            code, pxl_test, ast.buf.address, ast.start_x, ast.start_y)
+        return
+
+    def rect_commands(self, code, ast, drawing_func):
+        def rect(buf, x, y, width, height):
+            drawing_func(buf, (x, y), (width, height))
+            return 1
+        self.emit_native(
+            code, rect, ast.buf.address, ast.start_x, ast.start_y,
+            ast.kwargs['width'], ast.kwargs['height'])
+        return
+
+    def _rect(self, code, ast):
+        return self.rect_commands(code, ast, self.calculator.rect)
+
+    def _recti(self, code, ast):
+        return self.rect_commands(code, ast, self.calculator.inverse_rect)
+
+    def _circle(self, code, ast):
+        calc_circle = self.calculator.circle
+        def circle(buf, x, y, radius):
+            calc_circle(buf, (x, y), radius)
+            return 1
+        self.emit_native(
+            code, circle, ast.buf.address, ast.start_x, ast.start_y,
+            ast.kwargs['radius'])
+        return
+
+    def _draw_line(self, code, ast):
+        calc_line = self.calculator.line
+        def draw_line(buf, start_x, start_y, end_x, end_y):
+            calc_line(buf, (start_x, start_y), (end_x, end_y))
+            return 1
+        self.emit_native(
+            code, draw_line, ast.buf.address, ast.start_x, ast.start_y,
+            ast.kwargs['end_x'], ast.kwargs['end_y'])
+        return
+
+    def _dispgraph(self, code, ast):
+        s_state = ast.kwargs['state'].value
+        if s_state > 2:
+            disp_screen = self.calculator.disp_screen
+            def dispgraph(buf, backbuf):
+                disp_screen(buf, backbuf, s_state)
+                return None
+            self.emit_native(
+                code, dispgraph, ast.buf.address,
+                ast.kwargs['backbuffer'].address)
+        else:
+            disp_screen_mono = self.calculator.disp_screen_mono
+            def dispgraph(buf):
+                disp_screen_mono(buf)
+                return None
+            self.emit_native(code, dispgraph, ast.buf.address)
+        return
+
+    def _clrdraw(self, code, ast):
+        clear_rect = self.calculator.clear_rect
+        def clrdraw(buf):
+            clear_rect(buf, (0,0), (96,64))
+            return 1
+        self.emit_native(code, clrdraw, ast.buf.address)
+        return
+
+    ### Commands ###
+
+    def _disp(self, code, ast):
+        def disp(value):
+            print('Disp:', value)
+            return value
+        self.emit_native(code, disp, ast.children[0])
+        return
+
+    def _getkey(self, code, ast):
+        calculator = self.calculator
+        def getkey(number):
+            if number:
+                return calculator.is_key_pressed(number)
+            return calculator.is_any_key_pressed()
+        self.emit_native(code, getkey, ast.number)
+        return
+
+    def _rand(self, code, ast):
+        def rand():
+            return random.randint(0, 256**2 - 1)
+        self.emit_native(code, rand)
+        return
+
+    def _pause(self, code, ast):
+        def pause(delay):
+            time.sleep(delay / 1800)
+            return 0
+        self.emit_native(code, pause, ast.children[0])
+        return
+
+    def _notimplemented(self, code, ast):
+        code.emit(PUSH, 0)
+        return
+
+    ## Meta ##
+
+    def _debug(self, code, ast):
+        self.emit(code, ast.children[0])
+        return
+
+    def _about(self, code, ast):
+        def about():
+            print("Opening readme in web browser...")
+            webbrowser.open(os.path.realpath(r"readme/index.html"), 2)
+            return 1
+        self.emit_native(code, about)
+        return
+
+    _help = _about
+
+
+class BytecodeInterpreter(object):
+    """
+    Compiles an abstract syntax tree to Bytecode and runs it in a single
+    dispatch loop.
+
+    This is a drop-in alternative to an Interpreter object
+    (see 'axe/interpreter.py').  Instead of calling one closure per
+    instruction, every instruction is an entry in a pair of flat arrays, and
+    values are passed around on a stack rather than through nested calls.
+
+    Programs which use something the compiler doesn't understand are handed
+    to a regular Interpreter instead.
+    """
+    def __init__(self, calculator, profile=False):
+        self.calculator = calculator
+        self.compiler = Compiler(calculator)
+        self.fallback = axe.interpreter.Interpreter(calculator, profile)
+        return
+
+    def start(self):
+        self.calculator.init()
+        return
+
+    def execute(self, ast):
+        try:
+            bytecode = self.compiler.compile(ast)
+        except CompileError:
+            return self.fallback.execute(ast)
+        self.run(bytecode)
+        return
+
+    def sanity_check(self):
+        self.calculator.sanity_check()
+        return
+
+    def run(self, bytecode):
+        ops = bytecode.ops
+        args = bytecode.args
+        binary_ops = bytecode.binary_ops
+        natives = bytecode.natives
+        jump_targets = bytecode.jump_targets
+        memory = self.calculator._memory
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+
+        out = None
+        pc = 0
+        end = len(ops)
+        while pc < end:
+            op = ops[pc]
+            arg = args[pc]
+            pc += 1
+            if op == LOAD2_AT:
+                push(memory[arg] + memory[arg + 1] * 256)
+            elif op == PUSH:
+                push(arg)
+            elif op == STORE2_AT:
+                value = pop() % 65536
+                memory[arg] = value % 256
+                memory[arg + 1] = value // 256
+                push(value)
+            elif op == POP:
+                out = pop()
+            elif op == ADD:
+                value = pop()
+                stack[-1] += value
+            elif op == SUB:
+                value = pop()
+                stack[-1] -= value
+            elif op == MUL:
+                value = pop()
+                stack[-1] *= value
+            elif op == ADD_CONST:
+                stack[-1] += arg
+            elif op == BINARY:
+                value = pop()
+                stack[-1] = binary_ops[arg](stack[-1], value)
+            elif op == JUMP:
+                pc = arg
+            elif op == JUMP_IF_FALSE:
+                if pop() == 0:
+                    pc = arg
+            elif op == JUMP_IF_TRUE:
+                if pop():
+                    pc = arg
+            elif op == JUMP_IF_GT:
+                value = pop()
+                if pop() > value:
+                    pc = arg
+            elif op == LOAD1_AT:
+                push(memory[arg])
+            elif op == STORE1_AT:
+                value = stack[-1]
+                memory[arg] = value % 256
+            elif op == LOAD1:
+                push(memory[pop()])
+            elif op == LOAD2:
+                address = pop()
+                push(memory[address] + memory[address + 1] * 256)
+            elif op == STORE1:
+                address = pop()
+                memory[address] = stack[-1] % 256
+            elif op == STORE2:
+                address = pop()
+                value = stack[-1] % 65536
+                memory[address] = value % 256
+                memory[address + 1] = value // 256
+                stack[-1] = value
+            elif op == ADD_TO2_AT:
+                value = (memory[arg] + memory[arg + 1] * 256 + pop()) % 65536
+                memory[arg] = value % 256
+                memory[arg + 1] = value // 256
+            elif op == ADD_TO2:
+                address = pop()
+                value = memory[address] + memory[address + 1] * 256
+                value = (value + pop()) % 65536
+                memory[address] = value % 256
+                memory[address + 1] = value // 256
+            elif op == CALL:
+                function, argc = natives[arg]
+                if argc:
+                    values = stack[-argc:]
+                    del stack[-argc:]
+                    push(function(*values))
+                else:
+                    push(function())
+            elif op == JUMP_DYNAMIC:
+                target = pop()
+                if target not in jump_targets:
+                    raise InvalidJumpError(
+                        'Goto does not point at a label: ' + str(target))
+                pc = target
+        print('... ', out)
+        return
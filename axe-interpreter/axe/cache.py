@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+## System modules ##
+import os
+import time
+import hashlib
+import tempfile
+import cPickle
+
+## 3rd party modules ##
+import ply.yacc
+
+## Program modules ##
+import axe.lexer
+import axe.parser
+from axe.tokenizer import CHUNK_SIZE
+
+a = """
+Keeps the abstract syntax trees of programs which were parsed before, so that
+running an unchanged program again doesn't need to parse it again.
+
+Each tree is pickled into its own file in the cache directory.  The name of
+the file is a hash of both the source code and the version of the grammar
+(see 'grammar_version'), so editing either the program or the lexer/parser
+simply makes the old entries unreachable.  Those are removed later, once they
+are too old or the cache grows too large.
+
+Only the parsed tree is kept.  The optimizer (see 'axe/optimizer.py') still
+runs every time, since it modifies the tree in place.
+"""
+
+# Increase this if the way trees are stored changes.
+FORMAT = 1
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.path.expanduser('~'), '.axe-interpreter', 'cache')
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60     # In seconds.
+
+SUFFIX = '.ast'
+
+
+def grammar_version():
+    """
+    Returns a hash of everything a parsed tree depends on other than the
+    source code: the lexer (see 'axe.lexer.signature'), the parser and the
+    node classes in 'axe/parser.py', and the version of ply.
+    """
+    parser_file = os.path.splitext(axe.parser.__file__)[0] + '.py'
+    try:
+        with open(parser_file, 'rb') as source:
+            parser_info = source.read()
+    except IOError:
+        # No source (for example, when frozen into an exe), so fall back to
+        # the grammar rules themselves.
+        parser_info = sorted(
+            (name, getattr(axe.parser, name).__doc__)
+            for name in dir(axe.parser) if name.startswith('p_'))
+    info = (FORMAT, ply.yacc.__version__, axe.lexer.signature(), parser_info)
+    return hashlib.md5(repr(info)).hexdigest()
+
+
+class ParseCache(object):
+    """
+    An on-disk cache of parsed programs.
+
+    Parameters:
+
+    directory
+        Where to keep the cached trees.  Created if it doesn't exist.
+    max_bytes
+        Once the files in the cache add up to more than this, the least
+        recently used ones are removed.
+    max_age
+        Entries which haven't been used for this many seconds are removed.
+
+    Problems with the cache directory (for example, if it can't be written
+    to) are never fatal: the program is just parsed as normal.
+    """
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE):
+        self.directory = directory or DEFAULT_DIRECTORY
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.version = grammar_version()
+        return
+
+    def key(self, text):
+        return hashlib.sha1(self.version + '\0' + text).hexdigest()
+
+    def key_file(self, source):
+        """Like 'key', but reads the text from a file object a chunk at a 
+        time."""
+        digest = hashlib.sha1(self.version + '\0')
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, text):
+        """Returns the cached tree for 'text', or None if there isn't one."""
+        return self._load(self.key(text))
+
+    def put(self, text, ast):
+        """Stores the tree for 'text', then evicts old entries."""
+        self._store(self.key(text), ast)
+        return
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                ast = cPickle.load(entry)
+        except IOError:
+            return None
+        except Exception:
+            # A truncated or otherwise unreadable entry.
+            self._remove(path)
+            return None
+        try:
+            # Marks the entry as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return ast
+
+    def _store(self, key, ast):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            handle, temp_path = tempfile.mkstemp(
+                suffix='.tmp', dir=self.directory)
+        except (OSError, IOError):
+            return
+        path = self._path(key)
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                cPickle.dump(ast, entry, cPickle.HIGHEST_PROTOCOL)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows won't rename over an existing file.
+                self._remove(path)
+                os.rename(temp_path, path)
+        except (OSError, IOError, cPickle.PicklingError, RuntimeError):
+            self._remove(temp_path)
+            return
+        self.evict()
+        return
+
+    def parse(self, text, lexer, parser):
+        """
+        Returns the tree for 'text', parsing it with 'lexer' and 'parser' if
+        it isn't cached already.
+
+        Programs with syntax errors aren't cached, so that the errors are
+        reported every time they're run.
+        """
+        key = self.key(text)
+        ast = self._load(key)
+        if ast is not None:
+            return ast
+        errors = axe.parser.error_count
+        ast = parser.parse(text, lexer=lexer)
+        if ast is not None and axe.parser.error_count == errors:
+            self._store(key, ast)
+        return ast
+
+    def parse_file(self, source, tokenizer, parser):
+        """
+        Like 'parse', but for a program in the file object 'source', which is
+        read a chunk at a time with 'tokenizer' (see 'axe/tokenizer.py') if
+        it has to be parsed.  'source' has to be seekable.
+        """
+        key = self.key_file(source)
+        ast = self._load(key)
+        if ast is not None:
+            return ast
+        source.seek(0)
+        errors = axe.parser.error_count
+        tokenizer.input_file(source)
+        ast = parser.parse(lexer=tokenizer)
+        if ast is not None and axe.parser.error_count == errors:
+            self._store(key, ast)
+        return ast
+
+    def entries(self):
+        """Returns a list of (last used, size, path) for every entry."""
+        output = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return output
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            output.append((info.st_mtime, info.st_size, path))
+        return output
+
+    def evict(self):
+        """
+        Removes entries which are older than self.max_age, then the least
+        recently used ones until the cache is no larger than self.max_bytes.
+        """
+        entries = sorted(self.entries())
+        cutoff = time.time() - self.max_age
+        total = sum(size for (used, size, path) in entries)
+        for used, size, path in entries:
+            if used >= cutoff and total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+        return
+
+    def clear(self):
+        for used, size, path in self.entries():
+            self._remove(path)
+        return
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return
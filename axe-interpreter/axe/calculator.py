@@ -12,10 +12,38 @@ License: GNU Lesser GPL
 import os.path
 import sys
 import csv
-import array
+import mmap
+import ctypes
+import shutil
 
 ## 3rd party modules ##
-import pygame
+# Both are imported by load_pygame, the first time a window is needed.
+pygame = None
+numpy = None
+
+# Turns every byte into its bitwise inverse, for bytearray.translate.
+FLIP = ''.join(chr(0xFF ^ i) for i in xrange(256))
+
+
+def load_pygame():
+    """
+    Imports pygame, and numpy if it's installed.
+    
+    Importing pygame is slow, so this is put off until a Calculator actually
+    opens its window.  HeadlessCalculator never needs it.
+    """
+    global pygame
+    global numpy
+    if pygame is not None:
+        return pygame
+    import pygame
+    try:
+        import numpy
+        import pygame.surfarray
+    except ImportError:
+        # Optional -- the screen is drawn one blit at a time without it.
+        numpy = None
+    return pygame
 
 class Calculator(object):
     """
@@ -26,7 +54,8 @@ class Calculator(object):
     instances of an Interpreter class (see 'axe/interpreter.py').
     """
     ## Initialization ##
-    def __init__(self, size=(96,64), pixel_size=3, caption="Axe Interpreter"):
+    def __init__(self, size=(96,64), pixel_size=3, caption="Axe Interpreter",
+                 dither=False, memory_file=None):
         """
         Preps to set up graphics, memory, and a few other key components.
         
@@ -43,24 +72,50 @@ class Calculator(object):
             calculator pixel is equal to.
         caption="Axe Interpreter"
             The caption of the window
+        dither=False
+            If True, grayscale is shown the way a real calculator shows it,
+            by flickering between black and white frames each time the 
+            screen is updated, instead of being drawn in shades of gray.
+        memory_file=None
+            If given, the path to a file which holds the calculator's memory.
+            The file is mapped into memory, so other programs can read or 
+            map it to watch the memory change while a program runs.  Byte N
+            of the file is memory address N (so, for example, the screen 
+            buffer L6 starts at byte 37696).  The file is cleared when the
+            calculator starts.
         """
         self.pixel_size = pixel_size
         self.size = size
         self.caption = caption
+        self.memory_file = memory_file
+        self.dither = dither
+        self.frame = 0
+        self._shown = None
         return
     
     def init(self):
         """
-        Sets up graphics, memory, and a few other key components.
+        Sets up memory, and a few other key components.
         
-        This NEEDS to be called first in order for anything to happen.  Calling
-        this method will make the screen appear.
+        This NEEDS to be called first in order for anything to happen.  The
+        window only appears once something is displayed or a key is checked
+        (see self._open_window), so programs which never do either don't 
+        need pygame at all.
         """
-        self._init_graphics()
         self._init_memory()
-        self._init_getkey()
+        self.screen = None
+        return
+    
+    def _open_window(self):
+        """
+        Imports pygame, then sets up graphics and getKey.
         
-        self.disp_screen(37696)
+        This should not be called directly, and is called the first time the
+        window is needed.
+        """
+        load_pygame()
+        self._init_graphics()
+        self._init_getkey()
         return
     
     def _init_graphics(self):
@@ -68,7 +123,7 @@ class Calculator(object):
         Initializes pygame.
         
         This should not be called directly, and will be called only once, when
-        initializing.
+        the window is first opened.
         """
         pygame.init()
         self.screen = pygame.display.set_mode(self.size)
@@ -117,23 +172,34 @@ class Calculator(object):
         self.mono_optimize = {
             '00000000': self.white_strip,
             '11111111': self.black_strip}
-        self.three_optimize = {
-            '0000000000000000': self.white_strip,
-            '0000000011111111': self.gray_strip,
-            '1111111100000000': self.black_strip,
-            '1111111111111111': self.black_strip}
-        self.four_optimize = {
-            '0000000000000000': self.white_strip,
-            '0000000011111111': self.light_gray_strip,
-            '1111111100000000': self.dark_gray_strip,
-            '1111111111111111': self.black_strip}
-        self.optimize = {
-            2: self.mono_optimize,
-            3: self.three_optimize,
-            4: self.four_optimize}
+        self.three_strips = (
+            self.white_strip,
+            self.gray_strip,
+            self.black_strip,
+            self.black_strip)
+        self.four_strips = (
+            self.white_strip,
+            self.light_gray_strip,
+            self.dark_gray_strip,
+            self.black_strip)
+        self.gray = {
+            3: (self.three, self.three_strips),
+            4: (self.four, self.four_strips)}
         
         self.actual_size = self._screen_width // self.pixel_size
         
+        if numpy is not None:
+            self.mono_palette = numpy.array(
+                [self.WHITE, self.BLACK], dtype=numpy.uint8)
+            self.gray_palettes = {
+                3: numpy.array(
+                    [self.WHITE, self.GRAY, self.BLACK, self.BLACK], 
+                    dtype=numpy.uint8),
+                4: numpy.array(
+                    [self.WHITE, self.LIGHT_GRAY, self.DARK_GRAY, self.BLACK],
+                    dtype=numpy.uint8)}
+            self.bit_shifts = numpy.arange(8, dtype=numpy.uint8)
+        
         self.clock = pygame.time.Clock()
         self.time = 0
         return
@@ -142,13 +208,51 @@ class Calculator(object):
         """
         Initializes memory.
         
-        By default, memory is equal to 65535 bytes.  This should not be called
-        directly, and will be called only once, when initializing.
+        Memory is 65536 bytes, stored in a bytearray (so every value is 
+        always a single byte, and slices of it are copied in one go).  This
+        should not be called directly, and will be called only once, when
+        initializing.
         """
-        self._memory_size = 256 * 256 - 1
-        self._memory = array.array('H', [0 for i in xrange(self._memory_size)])
+        self._memory_size = 256 * 256
+        if self.memory_file is None:
+            self._memory = bytearray(self._memory_size)
+            return
+        
+        # On Python 2, an mmap reads and writes single-character strings, so
+        # a ctypes array over it is used to get at the bytes as integers.
+        with open(self.memory_file, 'wb') as ram:
+            ram.truncate(self._memory_size)
+        self._memory_file = open(self.memory_file, 'r+b')
+        self._memory_map = mmap.mmap(
+            self._memory_file.fileno(), self._memory_size)
+        ram_type = ctypes.c_ubyte * self._memory_size
+        self._memory = ram_type.from_buffer(self._memory_map)
         return
     
+    def snapshot(self, path):
+        """
+        Saves a copy of memory to a file at 'path', in the same format as the
+        'memory_file' parameter (see self.__init__).
+        """
+        if self.memory_file is not None:
+            self._memory_map.flush()
+            shutil.copyfile(self.memory_file, path)
+        else:
+            with open(path, 'wb') as snapshot:
+                snapshot.write(self._memory)
+        return
+    
+    def _read_buffer(self, buffer_loc):
+        """
+        Returns a copy of the screen buffer starting at 'buffer_loc', as a
+        bytearray.
+        """
+        data = self._memory[buffer_loc : buffer_loc + self._buffer_size]
+        if type(data) != bytearray:
+            # Slices of a memory file come back as lists.
+            data = bytearray(data)
+        return data
+    
     def _init_getkey(self):
         self._excluded_keys = (300, 301, 302)  # Num lock, Caps lock, Scroll lock
         self._keybindings = self._get_keybindings()
@@ -202,6 +306,8 @@ class Calculator(object):
         return tuple([x * self.pixel_size for x in list(pair)])
     
     def sanity_check(self):
+        if self.screen is None:
+            return
         self.time += self.clock.tick()
         if self.time > 200:
             for event in pygame.event.get():
@@ -336,38 +442,40 @@ class Calculator(object):
         if scale == 2:
             self.disp_screen_mono(buffer1_loc)
             return
-        buffer1 = self._memory[buffer1_loc : buffer1_loc + self._buffer_size]
-        buffer2 = self._memory[buffer2_loc : buffer2_loc + self._buffer_size]
+        if self.screen is None:
+            self._open_window()
+        buffer1 = self._read_buffer(buffer1_loc)
+        buffer2 = self._read_buffer(buffer2_loc)
         
-        for i in xrange(self._buffer_size):
-            buf1 = bin(buffer1[i])[2:].rjust(8, '0')
-            buf2 = bin(buffer2[i])[2:].rjust(8, '0')
-            
-            if buf1 + buf2 in self.optimize[scale].keys():
-                actual_i = i * 8
-                x = (actual_i % self.actual_size) * self.pixel_size
-                y = (actual_i // self.actual_size) * self.pixel_size
-                self.screen.blit(self.optimize[scale][buf1 + buf2], (x, y))
-                continue 
-                
-            if scale == 3:
-                colors = [self.three[int(buf1[c])*2 + int(buf2[c])] for c in xrange(8)]
-            elif scale == 4:
-                colors = [self.four[int(buf1[c])*2 + int(buf2[c])] for c in xrange(8)]
-            
-            for j in xrange(8):
-                actual_i = i * 8 + j
-                x = (actual_i % self.actual_size) * self.pixel_size
-                y = (actual_i // self.actual_size) * self.pixel_size
-                self.screen.blit(colors[7 - j], (x, y))
-        pygame.display.update()
+        if self.dither:
+            self._draw_mono(self._dither_frame(buffer1, buffer2, scale))
+        elif numpy is not None:
+            self._draw_gray_array(buffer1, buffer2, scale)
+        else:
+            self._draw_gray(buffer1, buffer2, scale)
         return
     
     def disp_screen_mono(self, buffer1_loc):
-        buffer1 = self._memory[buffer1_loc: buffer1_loc + self._buffer_size]
+        if self.screen is None:
+            self._open_window()
+        self._draw_mono(self._read_buffer(buffer1_loc))
+        return
+    
+    def _draw_mono(self, buffer1):
+        """
+        Draws a sequence of bytes to the screen in black and white.
+        
+        Only the parts which changed since the last time the screen was
+        drawn are redrawn.
+        """
+        rects = self._dirty_rects(2, buffer1)
+        if not rects:
+            return
+        if numpy is not None:
+            self._draw_mono_array(buffer1, rects)
+            return
         
-        rectangles = []
-        for i in xrange(self._buffer_size):
+        for i in self._rect_bytes(rects):
             buf1 = bin(buffer1[i])[2:].rjust(8, '0')
             if buf1 in self.mono_optimize.keys():
                 actual_i = i * 8
@@ -383,7 +491,162 @@ class Calculator(object):
                 y = (actual_i // self.actual_size) * self.pixel_size
                 self.screen.blit(colors[7-j], (x, y))
                 
-        pygame.display.update()
+        pygame.display.update(self._screen_rects(rects))
+        return
+    
+    def _draw_gray(self, buffer1, buffer2, scale):
+        """
+        Draws two sequences of bytes to the screen in grayscale, one blit per 
+        byte or pixel.
+        
+        Each pixel's shade is (front bit * 2 + back bit), looked up in 
+        self.three or self.four.
+        """
+        rects = self._dirty_rects(scale, buffer1, buffer2)
+        if not rects:
+            return
+        pixels, strips = self.gray[scale]
+        for i in self._rect_bytes(rects):
+            buf1 = buffer1[i]
+            buf2 = buffer2[i]
+            actual_i = i * 8
+            
+            if buf1 in (0, 255) and buf2 in (0, 255):
+                x = (actual_i % self.actual_size) * self.pixel_size
+                y = (actual_i // self.actual_size) * self.pixel_size
+                self.screen.blit(strips[(buf1 & 2) + (buf2 & 1)], (x, y))
+                continue
+            
+            for j in xrange(8):
+                shade = ((buf1 >> j) & 1) * 2 + ((buf2 >> j) & 1)
+                x = ((actual_i + j) % self.actual_size) * self.pixel_size
+                y = ((actual_i + j) // self.actual_size) * self.pixel_size
+                self.screen.blit(pixels[shade], (x, y))
+        pygame.display.update(self._screen_rects(rects))
+        return
+    
+    def _draw_mono_array(self, buffer1, rects):
+        """
+        Same as _draw_mono, but unpacks the whole buffer with numpy and draws
+        it with a single blit.
+        """
+        pixels = self._unpack_buffer(buffer1)
+        colors = self.mono_palette[pixels]
+        pygame.surfarray.blit_array(self.screen, self._scale_array(colors))
+        pygame.display.update(self._screen_rects(rects))
+        return
+    
+    def _draw_gray_array(self, buffer1, buffer2, scale):
+        """
+        Same as _draw_gray, but combines both buffers into palette indices 
+        with numpy and draws them with a single blit.
+        """
+        rects = self._dirty_rects(scale, buffer1, buffer2)
+        if not rects:
+            return
+        shades = (self._unpack_buffer(buffer1) << 1) | self._unpack_buffer(buffer2)
+        colors = self.gray_palettes[scale][shades]
+        pygame.surfarray.blit_array(self.screen, self._scale_array(colors))
+        pygame.display.update(self._screen_rects(rects))
+        return
+    
+    def _dither_frame(self, buffer1, buffer2, scale):
+        """
+        Returns the black and white frame a real calculator's screen would be
+        showing right now, and advances to the next frame.
+        
+        Grayscale on the calculator works by flickering pixels: with 3-scale
+        grayscale, pixels only on in the back buffer are shown every other 
+        frame; with 4-scale, the front buffer is shown for two frames out of
+        three and the back buffer for the third.  Calling DispGraph at the
+        calculator's refresh rate blends these together.
+        """
+        frame = self.frame
+        if scale == 3:
+            self.frame = (frame + 1) % 2
+            if frame == 0:
+                return bytearray(a | b for (a, b) in zip(buffer1, buffer2))
+            return buffer1
+        self.frame = (frame + 1) % 3
+        if frame < 2:
+            return buffer1
+        return buffer2
+    
+    def _dirty_rects(self, scale, buffer1, buffer2=None):
+        """
+        Compares what's about to be drawn with what's currently on the 
+        screen, and remembers it for next time.
+        
+        Returns a list of (x, y, width, height) rectangles, in calculator 
+        pixels, covering every byte that changed.  Rows that changed next to
+        each other are merged into one rectangle.  The whole screen is 
+        returned if the last thing drawn was in a different scale.
+        """
+        buffer1 = bytearray(buffer1)
+        if buffer2 is not None:
+            buffer2 = bytearray(buffer2)
+        shown = self._shown
+        self._shown = (scale, buffer1, buffer2)
+        
+        width = self.actual_size // 8
+        height = self._buffer_size // width
+        if shown is None or shown[0] != scale:
+            return [(0, 0, width * 8, height)]
+        
+        old1, old2 = shown[1], shown[2]
+        rects = []
+        top = None
+        for row in xrange(height + 1):
+            start = row * width
+            end = start + width
+            if row < height and (buffer1[start:end] != old1[start:end] or 
+                    buffer2 is not None and buffer2[start:end] != old2[start:end]):
+                columns = [i - start for i in xrange(start, end) 
+                           if buffer1[i] != old1[i] or 
+                              buffer2 is not None and buffer2[i] != old2[i]]
+                if top is None:
+                    top, left, right = row, columns[0], columns[-1]
+                else:
+                    left = min(left, columns[0])
+                    right = max(right, columns[-1])
+            elif top is not None:
+                rects.append((left * 8, top, (right - left + 1) * 8, row - top))
+                top = None
+        return rects
+    
+    def _rect_bytes(self, rects):
+        """Yields the index of every byte in the buffer inside 'rects' (as
+        returned by self._dirty_rects)."""
+        width = self.actual_size // 8
+        for (x, y, w, h) in rects:
+            for row in xrange(y, y + h):
+                for i in xrange(row * width + x // 8, row * width + (x + w) // 8):
+                    yield i
+        return
+    
+    def _screen_rects(self, rects):
+        """Converts rectangles in calculator pixels to computer pixels."""
+        return [self._fix_size(rect) for rect in rects]
+    
+    def _unpack_buffer(self, buffer1):
+        """
+        Returns a sequence of bytes as a (height, width) numpy array of 0s and
+        1s.  Within each byte, the lowest bit is the leftmost pixel.
+        """
+        width = self._screen_width // self.pixel_size
+        height = self._screen_height // self.pixel_size
+        data = numpy.frombuffer(buffer1, dtype=numpy.uint8)
+        bits = (data[:, numpy.newaxis] >> self.bit_shifts) & 1
+        return bits.reshape(height, width)
+    
+    def _scale_array(self, colors):
+        """
+        Turns a (height, width, 3) array of colors, one per calculator pixel,
+        into the (width, height, 3) array of computer pixels pygame expects.
+        """
+        colors = colors.repeat(self.pixel_size, axis=0)
+        colors = colors.repeat(self.pixel_size, axis=1)
+        return colors.transpose(1, 0, 2)
     
     def shift_buffer_vertical(self, buf, direction):
         if direction == 1: # shift down
@@ -487,8 +750,7 @@ class Calculator(object):
         size
             A tuple (width, height) of how large you want the rectangle to be.
         """
-        draw_solid = lambda buf, index: self._set_bit(buf, index)
-        self._generic_rect(buf, coords, size, draw_solid)
+        self._generic_rect(buf, coords, size, 'set')
         return
 
     def clear_rect(self, buf, coords, size):
@@ -505,8 +767,7 @@ class Calculator(object):
         size
             A tuple (width, height) of how large you want the rectangle to be.
         """
-        draw_clear = lambda buf, index: self._clear_bit(buf, index)
-        self._generic_rect(buf, coords, size, draw_clear)
+        self._generic_rect(buf, coords, size, 'clear')
         return
     
     def inverse_rect(self, buf, coords, size):
@@ -523,8 +784,7 @@ class Calculator(object):
         size
             A tuple (width, height) of how large you want the rectangle to be.
         """
-        draw_inverse = lambda buf, index: self._flip_bit(buf, index)
-        self._generic_rect(buf, coords, size, draw_inverse)
+        self._generic_rect(buf, coords, size, 'flip')
         return
     
     def pxl_get(self, buffer, coords):
@@ -533,13 +793,19 @@ class Calculator(object):
         index = x % 8
         return int(self._get_bit(location, index))
     
-    def _generic_rect(self, buf, coords, size, callback):
+    def _generic_rect(self, buf, coords, size, operation):
         """
         A generic rectangle-drawing function.
         
         This shouldn't directly be called, but is instead called by more
         specific drawing functions.
         
+        Pixel (x, y) is bit (y * width + x) of the buffer, counting from the
+        lowest bit of the first byte, so each row of the rectangle is a 
+        single run of bits.  Runs are drawn a whole byte at a time, with a 
+        mask for the partial bytes at either end.  If the rectangle is as 
+        wide as the screen, all of its rows form one run.
+        
         Parameters:
         buf
             The location in memory of the start of the buffer you want to draw
@@ -549,19 +815,58 @@ class Calculator(object):
             the rectangle to start
         size
             A tuple (width, height) of how large you want the rectangle to be.
-        callback
-            A function provided which needs to accept two variables -- the 
-            location of the byte to be drawn to, and the bit number.  The 
-            function must implement exactly what happens to the bit (is it
-            flipped?  Inverted? etc.)
+        operation
+            What happens to each bit in the rectangle.  One of 'set', 'clear',
+            or 'flip'.
         """
         x, y = coords
         w, h = size
+        if w <= 0 or h <= 0:
+            return
+        width = self._screen_width // self.pixel_size
+        if w == width:
+            self._draw_run(buf, y * width + x, (y + h) * width + x, operation)
+            return
         for j in xrange(y, y + h):
-            for i in xrange(x, x + w):
-                xt = i // 8
-                yt = j * self.size[0] // self.pixel_size // 8
-                callback(buf + xt + yt, i % 8)
+            start = j * width + x
+            self._draw_run(buf, start, start + w, operation)
+        return
+    
+    def _draw_run(self, buf, start, end, operation):
+        """
+        Applies 'operation' (see self._generic_rect) to bits 'start' up to
+        (but not including) 'end' of the buffer at 'buf'.
+        """
+        first = buf + (start >> 3)
+        last = buf + ((end - 1) >> 3)
+        head = (0xFF << (start & 7)) & 0xFF
+        tail = 0xFF >> (7 - ((end - 1) & 7))
+        if first == last:
+            self._mask_byte(first, head & tail, operation)
+            return
+        self._mask_byte(first, head, operation)
+        self._mask_byte(last, tail, operation)
+        
+        memory = self._memory
+        count = last - first - 1
+        if count <= 0:
+            return
+        if operation == 'set':
+            memory[first + 1 : last] = bytearray('\xff') * count
+        elif operation == 'clear':
+            memory[first + 1 : last] = bytearray(count)
+        elif operation == 'flip':
+            inverse = bytearray(memory[first + 1 : last]).translate(FLIP)
+            memory[first + 1 : last] = inverse
+        return
+    
+    def _mask_byte(self, loc, mask, operation):
+        if operation == 'set':
+            self._memory[loc] |= mask
+        elif operation == 'clear':
+            self._memory[loc] &= ~mask & 0xFF
+        elif operation == 'flip':
+            self._memory[loc] ^= mask
         return
     
     def and_sprite(self, buf, coords, size, data_buf):
@@ -630,6 +935,8 @@ class Calculator(object):
         return
     
     def is_any_key_pressed(self):
+        if self.screen is None:
+            self._open_window()
         pygame.event.pump()
         keys = list(pygame.key.get_pressed())
         # I'm doing all this because I don't want 'GetKey(0)' to trigger
@@ -644,9 +951,107 @@ class Calculator(object):
         return
     
     def is_key_pressed(self, key_num):
+        if self.screen is None:
+            self._open_window()
         pygame.event.pump()
         keys = list(pygame.key.get_pressed())
         for key in self._keybindings[key_num]:
             if keys[key]:
                 return 1
         return 0
+
+
+class HeadlessCalculator(Calculator):
+    """
+    A Calculator which never opens a window, and doesn't need pygame.
+    
+    Drawing works exactly the same, since it only ever touches memory.  
+    Displaying the screen copies the buffer(s) into self.screen instead of 
+    drawing them (see self.pixels), and getKey reads from a script of keys 
+    instead of the keyboard.
+    
+    This is meant for running programs in bulk or in tests.
+    """
+    def __init__(self, keys=None, size=(96,64), memory_file=None):
+        """
+        Parameters:
+        keys=None
+            A list with one item per frame, where each DispGraph moves on to
+            the next frame.  Each item is a collection of the getKey numbers
+            which are held down during that frame.  Once the list runs out,
+            no keys are held.
+        size=(96,64)
+            A tuple of the screen dimensions.
+        memory_file=None
+            Same as for Calculator.
+        """
+        Calculator.__init__(
+            self, size=size, pixel_size=1, memory_file=memory_file)
+        self.keys = list(keys or [])
+        return
+    
+    def init(self):
+        """
+        Sets up memory and a blank screen.
+        """
+        self._init_memory()
+        self.actual_size = self._screen_width
+        self.frames = 0
+        self.screen = (2, bytearray(self._buffer_size), None)
+        return
+    
+    def sanity_check(self):
+        return
+    
+    def kill_window(self):
+        return
+    
+    def disp_screen(self, buffer1_loc, buffer2_loc=None, scale=2):
+        backbuffer = None
+        if scale != 2:
+            backbuffer = self._read_buffer(buffer2_loc)
+        self.screen = (scale, self._read_buffer(buffer1_loc), backbuffer)
+        self.frames += 1
+        return
+    
+    def disp_screen_mono(self, buffer1_loc):
+        self.disp_screen(buffer1_loc)
+        return
+    
+    def pixels(self):
+        """
+        Returns what was last displayed, as a list of rows of shades.
+        
+        In black and white, each shade is 0 (white) or 1 (black).  In 
+        grayscale, each shade is (front bit * 2 + back bit), from 0 to 3, the 
+        same as the index into Calculator.three and Calculator.four.
+        """
+        scale, front, back = self.screen
+        width = self._screen_width
+        rows = []
+        for y in xrange(self._screen_height):
+            row = []
+            for x in xrange(width):
+                i = y * width + x
+                shade = (front[i // 8] >> (i % 8)) & 1
+                if back is not None:
+                    shade = shade * 2 + ((back[i // 8] >> (i % 8)) & 1)
+                row.append(shade)
+            rows.append(row)
+        return rows
+    
+    def held_keys(self):
+        """Returns the getKey numbers held down during the current frame."""
+        if self.frames < len(self.keys):
+            return self.keys[self.frames]
+        return ()
+    
+    def is_any_key_pressed(self):
+        if self.held_keys():
+            return 1
+        return 0
+    
+    def is_key_pressed(self, key_num):
+        if key_num in self.held_keys():
+            return 1
+        return 0
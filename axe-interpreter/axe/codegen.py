@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+from __future__ import print_function
+import os.path
+import random
+import time
+import webbrowser
+
+import axe.parser
+import axe.interpreter
+import axe.bytecode
+
+class CodegenError(axe.interpreter.AxeRuntimeError):
+    """The ast uses something that can't be turned into Python source."""
+    pass
+
+
+# The names every generated function takes as arguments.  Anything the
+# generated code needs at runtime must be passed in through one of these, so
+# that it's a fast local variable lookup rather than a global one.
+RUNTIME_NAMES = (
+    'm', 'load1', 'load2', 'store1', 'store2', 'disp', 'getkey', 'randint',
+    'sleep', 'rect', 'clear_rect', 'inverse_rect', 'pxl_get', 'circle',
+    'line', 'disp_screen', 'disp_screen_mono', 'readme')
+
+OPERATORS = {
+    'add': '+',
+    'sub': '-',
+    'mul': '*',
+    'div': '/',
+    'mod': '%',
+    'lt': '<',
+    'le': '<=',
+    'eq': '==',
+    'ne': '!=',
+    'gt': '>',
+    'ge': '>=',
+    'lshift': '<<',
+    'rshift': '>>',
+    'and_': '&'
+}
+
+
+class CodeGenerator(object):
+    """
+    Turns an abstract syntax tree (see 'axe/parser.py') into the source code
+    of a single Python function.
+
+    Control structures map onto real Python 'while', 'for' and 'if'
+    statements, and reading or writing variables at a fixed address indexes
+    straight into the calculator's memory.  Goto and Lbl have no Python
+    equivalent, so trying to generate code for them raises a CodegenError.
+    """
+    def __init__(self):
+        return
+
+    def generate(self, ast):
+        self.lines = []
+        self.indent = 1
+        self.temp_counter = 0
+        self.write('out = None')
+        self.statement(ast)
+        self.write('return out')
+        header = 'def axe_program({0}):'.format(', '.join(RUNTIME_NAMES))
+        return '\n'.join([header] + self.lines) + '\n'
+
+    def write(self, line):
+        self.lines.append('    ' * self.indent + line)
+        return
+
+    def temp(self):
+        self.temp_counter += 1
+        return '_t' + str(self.temp_counter)
+
+    def statement(self, ast):
+        if not ast:
+            return
+        try:
+            method = getattr(self, '_stmt_' + ast.name)
+        except AttributeError:
+            self.write('out = ' + self.expression(ast))
+            return
+        method(ast)
+        return
+
+    def body(self, ast):
+        start = len(self.lines)
+        self.indent += 1
+        self.statement(ast)
+        if len(self.lines) == start:
+            self.write('pass')
+        self.indent -= 1
+        return
+
+    def expression(self, ast):
+        if not ast:
+            return 'None'
+        try:
+            method = getattr(self, '_' + ast.name)
+        except AttributeError:
+            raise CodegenError('Cannot generate code for: ' + str(ast.name))
+        return method(ast)
+
+    ### Statements ###
+
+    def _stmt_program(self, ast):
+        for subtree in ast.children:
+            self.statement(subtree)
+        return
+
+    def _stmt_block(self, ast):
+        for subtree in ast.children:
+            if subtree and subtree.name in ('horizontal', 'vertical'):
+                # The closure engine never appends these either.
+                continue
+            self.statement(subtree)
+        return
+
+    def _stmt_line(self, ast):
+        self.statement(ast.children[0])
+        return
+
+    def _stmt_assignment(self, ast):
+        address = axe.bytecode.constant(ast.pointer.address)
+        if address is None:
+            self.write('out = ' + self._assignment(ast))
+        elif ast.pointer.size == 1:
+            self.write('out = ' + self.expression(ast.value))
+            self.write('m[{0}] = out % 256'.format(address))
+        else:
+            self.write('out = ({0}) % 65536'.format(self.expression(ast.value)))
+            self.write('m[{0}] = out % 256'.format(address))
+            self.write('m[{0}] = out // 256'.format(address + 1))
+        return
+
+    def _stmt_while(self, ast):
+        self.write('while {0}:'.format(self.expression(ast.children['condition'])))
+        self.body(ast.children['body'])
+        return
+
+    def _stmt_repeat(self, ast):
+        self.write('while not {0}:'.format(self.expression(ast.children['condition'])))
+        self.body(ast.children['body'])
+        return
+
+    def _stmt_if(self, ast):
+        self.write('if {0}:'.format(self.expression(ast.children['condition'])))
+        self.body(ast.children['body'])
+        return
+
+    def _stmt_if_else(self, ast):
+        self.write('if {0}:'.format(self.expression(ast.children['condition'])))
+        self.body(ast.children['body'].children[0])
+        self.write('else:')
+        self.body(ast.children['body'].children[1])
+        return
+
+    def _stmt_for(self, ast):
+        pointer = ast.children['pointer']
+        if self.is_simple_for(ast):
+            self._stmt_simple_for(ast)
+            return
+        load = self.expression(pointer)
+        store = self.store(pointer, '{0} + {1}'.format(
+            load, self.expression(ast.children['increment'])))
+        self.statement(axe.parser.Assignment(
+            value=ast.children['start'], pointer=pointer))
+        self.write('while not {0} > {1}:'.format(
+            load, self.expression(ast.children['end'])))
+        self.body(ast.children['body'])
+        self.indent += 1
+        self.write(store)
+        self.indent -= 1
+        return
+
+    def is_simple_for(self, ast):
+        """
+        Checks if a For loop can become a Python 'for' over an xrange.
+
+        That needs constant bounds, a fixed 2-byte loop variable, and a body
+        which can't possibly write to the loop variable.
+        """
+        pointer = ast.children['pointer']
+        address = axe.bytecode.constant(pointer.address)
+        start = axe.bytecode.constant(ast.children['start'])
+        end = axe.bytecode.constant(ast.children['end'])
+        increment = axe.bytecode.constant(ast.children['increment'])
+        if None in (address, start, end) or increment != 1:
+            return False
+        if pointer.size != 2 or not (0 <= start < 65535 and 0 <= end < 65535):
+            return False
+        for node in axe.parser.nodes(ast.children['body']):
+            if node.name == 'assignment':
+                target = node.pointer
+            elif node.name == 'for':
+                target = node.children['pointer']
+            else:
+                continue
+            target_address = axe.bytecode.constant(target.address)
+            if target_address is None or abs(target_address - address) < 2:
+                return False
+        return True
+
+    def _stmt_simple_for(self, ast):
+        address = axe.bytecode.constant(ast.children['pointer'].address)
+        start = axe.bytecode.constant(ast.children['start'])
+        end = axe.bytecode.constant(ast.children['end'])
+        counter = self.temp()
+        self.write('for {0} in xrange({1}, {2}):'.format(counter, start, end + 1))
+        self.indent += 1
+        self.write('m[{0}] = {1} % 256'.format(address, counter))
+        self.write('m[{0}] = {1} // 256'.format(address + 1, counter))
+        self.indent -= 1
+        self.body(ast.children['body'])
+        final = end + 1 if start <= end else start
+        self.write('m[{0}] = {1}'.format(address, final % 256))
+        self.write('m[{0}] = {1}'.format(address + 1, final // 256))
+        return
+
+    def _stmt_label(self, ast):
+        raise CodegenError('Labels are not supported')
+
+    def _stmt_goto(self, ast):
+        raise CodegenError('Gotos are not supported')
+
+    ### Expressions ###
+
+    def _expression(self, ast):
+        if type(ast.value) == int:
+            return str(ast.value)
+        return self.expression(ast.value)
+
+    def _operation(self, ast):
+        op = ' ' + OPERATORS[ast.op] + ' '
+        seed = self.expression(ast.args[0])
+        for arg in ast.args[1:]:
+            seed = '(' + seed + op + self.expression(arg) + ')'
+        return seed
+
+    def _assignment(self, ast):
+        return self.store(ast.pointer, self.expression(ast.value))
+
+    def store(self, pointer, value):
+        address = axe.bytecode.constant(pointer.address)
+        if address is None:
+            address = self.expression(pointer.address)
+        return 'store{0}({1}, {2})'.format(pointer.size, address, value)
+
+    def _pointer(self, ast):
+        address = axe.bytecode.constant(ast.address)
+        if address is None:
+            return 'load{0}({1})'.format(ast.size, self.expression(ast.address))
+        if ast.size == 1:
+            return 'm[{0}]'.format(address)
+        return '(m[{0}] + m[{1}] * 256)'.format(address, address + 1)
+
+    def _dereference(self, ast):
+        return self.expression(ast.children[0].address)
+
+    def _get_label(self, ast):
+        raise CodegenError('Labels are not supported')
+
+    def call(self, name, *args):
+        return '{0}({1})'.format(name, ', '.join(args))
+
+    def buffer_call(self, name, ast, *args):
+        return self.call(
+            name, self.expression(ast.buf.address), *args)
+
+    def coords(self, x, y):
+        return '({0}, {1})'.format(self.expression(x), self.expression(y))
+
+    ### Drawing ###
+
+    def pxl_commands(self, ast, name):
+        return '({0}, 1)[1]'.format(self.buffer_call(
+            name, ast, self.coords(ast.start_x, ast.start_y), '(1, 1)'))
+
+    def _pxl_on(self, ast):
+        return self.pxl_commands(ast, 'rect')
+
+    def _pxl_off(self, ast):
+        return self.pxl_commands(ast, 'clear_rect')
+
+    def _pxl_change(self, ast):
+        return self.pxl_commands(ast, 'inverse_rect')
+
+    def _pxl_test(self, ast):
+        return self.buffer_call(
+            'pxl_get', ast, self.coords(ast.start_x, ast.start_y))
+
+    def rect_commands(self, ast, name):
+        return '({0}, 1)[1]'.format(self.buffer_call(
+            name, ast, self.coords(ast.start_x, ast.start_y),
+            self.coords(ast.kwargs['width'], ast.kwargs['height'])))
+
+    def _rect(self, ast):
+        return self.rect_commands(ast, 'rect')
+
+    def _recti(self, ast):
+        return self.rect_commands(ast, 'inverse_rect')
+
+    def _circle(self, ast):
+        return '({0}, 1)[1]'.format(self.buffer_call(
+            'circle', ast, self.coords(ast.start_x, ast.start_y),
+            self.expression(ast.kwargs['radius'])))
+
+    def _draw_line(self, ast):
+        return '({0}, 1)[1]'.format(self.buffer_call(
+            'line', ast, self.coords(ast.start_x, ast.start_y),
+            self.coords(ast.kwargs['end_x'], ast.kwargs['end_y'])))
+
+    def _dispgraph(self, ast):
+        s_state = ast.kwargs['state'].value
+        if s_state > 2:
+            call = self.buffer_call(
+                'disp_screen', ast,
+                self.expression(ast.kwargs['backbuffer'].address),
+                str(s_state))
+        else:
+            call = self.buffer_call('disp_screen_mono', ast)
+        return '({0}, None)[1]'.format(call)
+
+    def _clrdraw(self, ast):
+        return '({0}, 1)[1]'.format(
+            self.buffer_call('clear_rect', ast, '(0, 0)', '(96, 64)'))
+
+    ### Commands ###
+
+    def _disp(self, ast):
+        return self.call('disp', self.expression(ast.children[0]))
+
+    def _getkey(self, ast):
+        return self.call('getkey', self.expression(ast.number))
+
+    def _rand(self, ast):
+        return 'randint(0, 65535)'
+
+    def _pause(self, ast):
+        return '(sleep({0} / 1800), 0)[1]'.format(
+            self.expression(ast.children[0]))
+
+    def _notimplemented(self, ast):
+        return '0'
+
+    ## Meta ##
+
+    def _debug(self, ast):
+        return self.expression(ast.children[0])
+
+    def _about(self, ast):
+        return 'readme()'
+
+    _help = _about
+
+
+class PythonInterpreter(object):
+    """
+    Runs an abstract syntax tree by turning it into Python source code,
+    compiling that, and calling the result.
+
+    This is a drop-in alternative to an Interpreter object
+    (see 'axe/interpreter.py').  Programs using Goto or Lbl are handed to a
+    regular Interpreter instead.
+    """
+    def __init__(self, calculator, profile=False):
+        self.calculator = calculator
+        self.generator = CodeGenerator()
+        self.fallback = axe.interpreter.Interpreter(calculator, profile)
+        return
+
+    def start(self):
+        self.calculator.init()
+        return
+
+    def execute(self, ast):
+        try:
+            source = self.generator.generate(ast)
+        except CodegenError:
+            return self.fallback.execute(ast)
+        function = self.compile(source)
+        out = function(**self.runtime())
+        print('... ', out)
+        return
+
+    def compile(self, source):
+        return compile_function(source)
+
+    def sanity_check(self):
+        self.calculator.sanity_check()
+        return
+
+    def runtime(self):
+        """Builds the values passed in to the generated function."""
+        return runtime(self.calculator)
+
+
+def compile_function(source, name='axe_program'):
+    """Compiles the source of a generated function, and returns it."""
+    namespace = {}
+    # 'dont_inherit' keeps this module's __future__ imports from changing
+    # what '/' means inside the generated code.
+    exec compile(source, '<axe>', 'exec', 0, True) in namespace
+    return namespace[name]
+
+def runtime(calculator):
+    """Builds the values passed in to a generated function (see 
+    RUNTIME_NAMES), for 'calculator'."""
+    m = calculator._memory
+
+    def load1(address):
+        return m[address]
+
+    def load2(address):
+        return m[address] + m[address + 1] * 256
+
+    def store1(address, value):
+        m[address] = value % 256
+        return value
+
+    def store2(address, value):
+        value = value % 65536
+        m[address] = value % 256
+        m[address + 1] = value // 256
+        return value
+
+    def disp(value):
+        print('Disp:', value)
+        return value
+
+    def getkey(number):
+        if number:
+            return calculator.is_key_pressed(number)
+        return calculator.is_any_key_pressed()
+
+    def readme():
+        print("Opening readme in web browser...")
+        webbrowser.open(os.path.realpath(r"readme/index.html"), 2)
+        return 1
+
+    return {
+        'm': m,
+        'load1': load1,
+        'load2': load2,
+        'store1': store1,
+        'store2': store2,
+        'disp': disp,
+        'getkey': getkey,
+        'randint': random.randint,
+        'sleep': time.sleep,
+        'rect': calculator.rect,
+        'clear_rect': calculator.clear_rect,
+        'inverse_rect': calculator.inverse_rect,
+        'pxl_get': calculator.pxl_get,
+        'circle': calculator.circle,
+        'line': calculator.line,
+        'disp_screen': calculator.disp_screen,
+        'disp_screen_mono': calculator.disp_screen_mono,
+        'readme': readme
+    }
@@ -19,6 +19,10 @@ import time
 
 import axe.lexer
 import axe.parser
+import axe.tokenizer
+import axe.optimizer
+import axe.peephole
+import axe.registers
 import axe.calculator
 
 class AxeRuntimeError(Exception):
@@ -28,6 +32,21 @@ class AxeRuntimeError(Exception):
 class MissingLabelException(AxeRuntimeError):
     """A goto or function is referencing a missing label."""
     pass
+    
+class InvalidJumpException(AxeRuntimeError):
+    """A computed goto is jumping somewhere that isn't a label."""
+    pass
+
+# Nodes which can move the counter somewhere other than the next line.
+JUMPS = ('label', 'goto', 'get_label', 'call', 'return')
+BRANCHES = ('while', 'repeat', 'for', 'if', 'if_else')
+
+# Nodes which can't touch memory, apart from through the pointers and 
+# assignments beneath them.
+MEMORY_SAFE = ('block', 'line', 'body', 'expression', 'operation', 
+               'assignment', 'pointer', 'dereference', 'while', 'repeat', 
+               'for', 'if', 'if_else', 'disp', 'getkey', 'rand', 'pause', 
+               'notimplemented')
 
 class Interpreter(object):
     """
@@ -61,8 +80,12 @@ class Interpreter(object):
     # The demo interpreter itself saves the state of the calculator so that 
     # subsequent statements can be 
     # (although it 
-    def __init__(self, calculator):
+    def __init__(self, calculator, profile=False):
         self.calculator = calculator
+        self.profile = profile
+        self.promoted = {}
+        self.bindings = Bindings(calculator)
+        self.registers = axe.registers.Registers(self.bindings)
         return
     
     def start(self):
@@ -70,27 +93,93 @@ class Interpreter(object):
         return
     
     def execute(self, ast):
-        code = Code()
+        code = self.compile(ast)
+        self.run(code)
+        print('... ', code.ans)
+        if self.profile:
+            print(axe.peephole.report(code))
+        return
+    
+    def compile(self, ast, code=None):
+        """
+        Flattens the ast into a Code object, and returns it.  If 'code' is 
+        given, the new lines are added to the end of it instead, and nothing
+        already in it is compiled again.
+        """
+        if code is None:
+            code = Code()
         self.check = 'before'
         self.flatten(code, ast)
+        code.link()
+        axe.peephole.Peephole(self, self.profile).fuse(code)
+        self.trace(code)
         self.check = 'after'
-        self.run(code)
-        return
+        return code
+    
+    def trace(self, code):
+        """Makes the loops in 'code' compile themselves once they're hot 
+        (see 'axe/jit.py')."""
+        # Imported here, since the code generator it uses imports this 
+        # module.
+        import axe.jit
+        axe.jit.Tracer(self, self.profile).install(code)
+        return code
 
     def flatten(self, code, ast):
         if not ast:
             return None
-        return getattr(self, '_' + ast.name)(code, ast)
+        l_output = getattr(self, '_' + ast.name)(code, ast)
+        if ast.name in axe.registers.DRAWING:
+            l_output = self._guard(ast, l_output)
+        return l_output
 
-    def run(self, code):
-        out = None
+    def run(self, code, budget=None):
+        """
+        Runs flattened code, starting from wherever it last stopped.
+        
+        The program halts once the counter reaches the end of the code,
+        either by running off the last line or by jumping there.
+        
+        Parameters:
+        code
+            A Code object, as returned by self.compile.
+        budget=None
+            If given, the maximum number of lines to run before returning.
+            Calling this method again with the same Code object picks up
+            where the last call left off.  A loop which has been compiled 
+            (see 'axe/jit.py') runs to the end as a single line.
+        
+        Returns True if the program has halted, and False if it stopped
+        because it ran out of budget.  The value of the last line run is 
+        kept in 'code.ans'.
+        
+        The variables A to Z are read from memory before the code runs, and
+        written back once it stops, even if it stops with an error (see 
+        'axe/registers.py').  If self.calculator (or its memory) has been 
+        replaced since the code was compiled, the code uses the new one.
+        """
+        lines = code.code
+        end = len(lines)
+        out = code.ans
+        token = code.next_token
+        self.bindings.update(self.calculator)
+        self.registers.load()
         try:
-            while True:
-                out = code.next()(code)
-        except TypeError:
-            pass
-        print('... ', out)
-        return
+            if budget is None:
+                while token < end:
+                    code.next_token = token + 1
+                    out = lines[token](code)
+                    token = code.next_token
+            else:
+                while token < end and budget > 0:
+                    code.next_token = token + 1
+                    out = lines[token](code)
+                    token = code.next_token
+                    budget -= 1
+        finally:
+            self.registers.store()
+        code.ans = out
+        return token >= end
     
     def sanity_check(self):
         self.calculator.sanity_check()
@@ -110,9 +199,16 @@ class Interpreter(object):
     
     def _line(self, code, ast):
         line = ast.children[0]
-        l_output = self.flatten(code, line)
+        if type(line) == axe.parser.Expression and self.is_call(line.value):
+            # The value isn't needed, so this can jump instead (see 
+            # self._call)
+            l_output = self._call(code, line.value, s_jump=True)
+        else:
+            l_output = self.flatten(code, line)
         assert(type(l_output) != int)
-        code.append(l_output)
+        s_line = code.append(l_output)
+        if isinstance(line, axe.parser.Assignment):
+            code.describe(s_line, 'store', assignment=line)
         return l_output
     
     ### Numerical components ###
@@ -127,40 +223,37 @@ class Interpreter(object):
         return
     
     def _operation(self, code, ast):
-        def collapse(list_, op):
-            seed = list_[0]
-            for num in list_[1:]:
-                seed = getattr(operator, op)(seed, num)
-            return seed
-        
-        args = []
-        numbers_args = []
-        for arg in ast.args:
-            if type(arg) == int:
-                numbers_args.append(arg)
-            elif type(arg) == bool:
-                numbers_args.append(int(arg, 10))
-            else:
-                if len(numbers_args) >= 2:
-                    args.append(collapse(numbers_args, ast.op))
-                else:
-                    args.extend(numbers_args)
-                numbers_arg = []
-                args.append(arg)
-        if len(numbers_args) >= 2:
-            args.append(collapse(numbers_args, ast.op))
-        else:
-            args.extend(numbers_args)
-        
-        l_seed = self.flatten(code, args[0])
+        # Constants are folded ahead of time (see 'axe/optimizer.py').
+        # Every operand is flattened exactly once, here, and the most common
+        # shapes get a closure which doesn't need to loop over its operands.
         operation = getattr(operator, ast.op)
-        subargs = args[1:]
-        def l_operation(other):
-            s_seed = l_seed(other)
-            for l_expression in subargs:
-                s_term = self.flatten(code, l_expression)(other)
-                s_seed = operation(s_seed, s_term)
-            return s_seed
+        l_args = [self.flatten(code, arg) for arg in ast.args]
+        s_last = ast.args[-1]
+        s_constant = (type(s_last) == axe.parser.Expression and 
+                      type(s_last.value) == int)
+        
+        if len(l_args) == 2 and s_constant:
+            l_left = l_args[0]
+            s_right = s_last.value
+            def l_operation(other):
+                return operation(l_left(other), s_right)
+        elif len(l_args) == 2:
+            l_left, l_right = l_args
+            def l_operation(other):
+                return operation(l_left(other), l_right(other))
+        elif len(l_args) == 3:
+            l_left, l_middle, l_right = l_args
+            def l_operation(other):
+                return operation(
+                    operation(l_left(other), l_middle(other)), l_right(other))
+        else:
+            l_seed = l_args[0]
+            l_rest = tuple(l_args[1:])
+            def l_operation(other):
+                s_seed = l_seed(other)
+                for l_term in l_rest:
+                    s_seed = operation(s_seed, l_term(other))
+                return s_seed
         return l_operation
     
     ### Pointers and assignment ###
@@ -170,28 +263,114 @@ class Interpreter(object):
         s_size = ast.pointer.size
         l_value = self.flatten(code, ast.value)
         
+        s_address = axe.peephole.constant(ast.pointer.address)
+        s_index = axe.registers.index(s_address, s_size)
+        if s_index is not None:
+            # One of A to Z (see 'axe/registers.py')
+            s_values = self.registers.values
+            def l_set_register(other):
+                s_value = l_value(other) % 65536
+                s_values[s_index] = s_value
+                return s_value
+            return l_set_register
+        
+        s_bindings = self.bindings
+        if not axe.registers.overlaps(s_address, s_size):
+            # Nowhere near A to Z, so memory can be written directly.
+            if s_size == 1:
+                def l_store_1(other):
+                    s_value = l_value(other)
+                    s_bindings.memory[s_address] = s_value % 256
+                    return s_value
+                return l_store_1
+            s_high = s_address + 1
+            def l_store_2(other):
+                s_value = l_value(other) % 65536
+                s_memory = s_bindings.memory
+                s_memory[s_address] = s_value % 256
+                s_memory[s_high] = s_value // 256
+                return s_value
+            return l_store_2
+        
+        # Anything which might touch A to Z goes through the registers.
+        get_var, set_var = self.registers.accessors(None, s_size)
+        s_low = axe.registers.BASE - s_size
+        s_end = axe.registers.END
         if s_size == 1:
-            def l_set_var(other):
-                return self.calculator.set_var_1(l_address(other), l_value(other))
-        elif s_size == 2:
-            def l_set_var(other):
+            def l_set_var_1(other):
+                address = l_address(other)
                 s_value = l_value(other)
-                return self.calculator.set_var_2(l_address(other), l_value(other))
-            
-        return l_set_var
+                if s_low < address < s_end:
+                    return set_var(address, s_value)
+                s_bindings.memory[address] = s_value % 256
+                return s_value
+            return l_set_var_1
+        
+        def l_set_var_2(other):
+            address = l_address(other)
+            s_value = l_value(other)
+            if s_low < address < s_end:
+                return set_var(address, s_value)
+            s_value = s_value % 65536
+            s_memory = s_bindings.memory
+            s_memory[address] = s_value % 256
+            s_memory[address + 1] = s_value // 256
+            return s_value
+        return l_set_var_2
     
     def _pointer(self, code, ast):
         l_address = self.flatten(code, ast.address)
         s_size = ast.size
         
+        s_key = (axe.peephole.constant(ast.address), s_size)
+        if s_key in self.promoted:
+            # The counter of an enclosing For loop (see self._fast_for)
+            s_cell = self.promoted[s_key]
+            def l_promoted(other):
+                return s_cell[0]
+            return l_promoted
+        
+        s_address = s_key[0]
+        s_index = axe.registers.index(s_address, s_size)
+        if s_index is not None:
+            # One of A to Z (see 'axe/registers.py')
+            s_values = self.registers.values
+            def l_register(other):
+                return s_values[s_index]
+            return l_register
+        
+        s_bindings = self.bindings
+        if not axe.registers.overlaps(s_address, s_size):
+            # Nowhere near A to Z, so memory can be read directly.
+            if s_size == 1:
+                def l_load_1(other):
+                    return s_bindings.memory[s_address]
+                return l_load_1
+            s_high = s_address + 1
+            def l_load_2(other):
+                s_memory = s_bindings.memory
+                return s_memory[s_address] + s_memory[s_high] * 256
+            return l_load_2
+        
+        # Anything which might touch A to Z goes through the registers.
+        get_var, set_var = self.registers.accessors(None, s_size)
+        s_low = axe.registers.BASE - s_size
+        s_end = axe.registers.END
         if s_size == 1:
-            def l_pointer(other):
-                return self.calculator.get_var_1(l_address(other))
-        elif s_size == 2:
-            def l_pointer(other):
-                return self.calculator.get_var_2(l_address(other))
+            def l_pointer_1(other):
+                address = l_address(other)
+                if s_low < address < s_end:
+                    return get_var(address)
+                return s_bindings.memory[address]
+            return l_pointer_1
         
-        return l_pointer
+        def l_pointer_2(other):
+            address = l_address(other)
+            if s_low < address < s_end:
+                return get_var(address)
+            s_memory = s_bindings.memory
+            return s_memory[address] + s_memory[address + 1] * 256
+        return l_pointer_2
     
     def _dereference(self, code, ast):
         l_address = self.flatten(code, ast.children[0].address)
@@ -214,6 +393,8 @@ class Interpreter(object):
         def l_jump_while(other):
             other.jump(s_start)
         s_end = code.append(l_jump_while)
+        self.add_loop(code, s_end, ast, head=s_start, exit=s_end + 1, 
+                      returns=0)
         
         # Modify placeholder
         def l_check_while(other):
@@ -222,6 +403,9 @@ class Interpreter(object):
             return 0
         
         code.replace(s_start, l_check_while)
+        code.describe(s_start, 'compare_jump', 
+            condition=ast.children['condition'], target=s_end + 1, 
+            jump_if=False, returns=0)
         
         return lambda other: 0
     
@@ -233,6 +417,8 @@ class Interpreter(object):
         def l_jump_repeat(other):
             other.jump(s_start)
         s_end = code.append(l_jump_repeat)
+        self.add_loop(code, s_end, ast, head=s_start, exit=s_end + 1, 
+                      returns=1)
         
         def l_check_repeat(other):
             if l_condition(other):
@@ -240,6 +426,9 @@ class Interpreter(object):
             return 1
         
         code.replace(s_start, l_check_repeat)
+        code.describe(s_start, 'compare_jump', 
+            condition=ast.children['condition'], target=s_end + 1, 
+            jump_if=True, returns=1)
         
         return lambda other: 0
     
@@ -251,15 +440,17 @@ class Interpreter(object):
         #     jump to label TOP
         # label EXIT
         
+        s_mode = self.fast_for_mode(ast)
+        if s_mode:
+            return self._fast_for(code, ast, s_mode)
+        
         # Get initial vars
         l_pointer = self.flatten(code, ast.children['pointer'])
         l_address = self.flatten(code, ast.children['pointer'].address)
         s_size = ast.children['pointer'].size
         
-        if s_size == 1:
-            calc_set_var = self.calculator.set_var_1
-        elif s_size == 2:
-            calc_set_var = self.calculator.set_var_2
+        calc_get_var, calc_set_var = self.registers.accessors(
+            axe.peephole.constant(ast.children['pointer'].address), s_size)
         
         l_start = self.flatten(code, ast.children['start'])
         l_end = self.flatten(code, ast.children['end'])
@@ -291,7 +482,7 @@ class Interpreter(object):
             other.jump(s_check)
             return calc_set_var(s_address, s_value)
         
-        code.append(l_update_for)
+        s_update = code.append(l_update_for)
         
         # Goto start
         def l_jump_for(other):
@@ -308,7 +499,152 @@ class Interpreter(object):
             #return other.ans
         
         code.replace(s_check, l_condition_for)
+        code.describe(s_update, 'for_tail', 
+            pointer=ast.children['pointer'], end=ast.children['end'], 
+            increment=ast.children['increment'], body=s_check + 1, 
+            exit=s_exit + 1)
+        # Once fused, the update jumps back into the body itself, so that's
+        # the bottom of the loop.
+        self.add_loop(code, s_update, ast, head=s_check, exit=s_exit + 1, 
+                      returns=None, body=s_check + 1)
         return lambda other: 0
+    
+    def add_loop(self, code, line, ast, **info):
+        """Records a loop for self.trace, unless it reads the counter of a
+        For loop around it which isn't kept in memory (see self._fast_for)
+        """
+        if not self.promoted:
+            code.add_loop(line, ast=ast, **info)
+        return
+    
+    def fast_for_mode(self, ast):
+        """
+        Decides whether a For loop can run as a single closure, which loops 
+        in Python instead of jumping around the Code object.
+        
+        The loop variable, start, end, and increment must all be constants
+        (after folding; see 'axe/optimizer.py'), and nothing in the body may 
+        jump.
+        
+        Returns one of:
+        
+        'promote'
+            The body never writes to the loop variable and only reads it 
+            through its own name, so the counter can live in a Python int and
+            only be written to memory once the loop is done.
+        'sync'
+            The counter is kept in memory, as usual, but the condition and 
+            update still run without any closures.
+        None
+            The loop has to run the slow way.
+        """
+        pointer = ast.children['pointer']
+        s_address = axe.peephole.constant(pointer.address)
+        s_size = pointer.size
+        s_values = [axe.peephole.constant(ast.children[name]) 
+                    for name in ('start', 'end', 'increment')]
+        if s_address is None or None in s_values:
+            return None
+        s_start, s_end, s_increment = s_values
+        
+        def overlaps(other):
+            s_other = axe.peephole.constant(other.address)
+            if s_other is None:
+                return True
+            return s_other < s_address + s_size and s_address < s_other + other.size
+        
+        s_mode = 'promote'
+        if s_increment <= 0 or s_end + s_increment >= 256 ** s_size:
+            # The counter would wrap around.
+            s_mode = 'sync'
+        for node in axe.parser.nodes(ast.children['body']):
+            if node.name in JUMPS:
+                return None
+            if node.name not in MEMORY_SAFE:
+                s_mode = 'sync'
+            elif node.name == 'assignment' and overlaps(node.pointer):
+                s_mode = 'sync'
+            elif node.name == 'for' and overlaps(node.children['pointer']):
+                s_mode = 'sync'
+            elif node.name == 'pointer' and overlaps(node):
+                if (axe.peephole.constant(node.address), node.size) != (s_address, s_size):
+                    s_mode = 'sync'
+        return s_mode
+    
+    def _fast_for(self, code, ast, s_mode):
+        pointer = ast.children['pointer']
+        s_address = axe.peephole.constant(pointer.address)
+        s_size = pointer.size
+        s_start = axe.peephole.constant(ast.children['start'])
+        s_end = axe.peephole.constant(ast.children['end'])
+        s_increment = axe.peephole.constant(ast.children['increment'])
+        
+        calc_get_var, calc_set_var = self.registers.accessors(s_address, s_size)
+        
+        # The body gets its own Code object, which is run to the end once per
+        # iteration.
+        body = Code()
+        body.fusions = code.fusions
+        s_cell = [0]
+        s_key = (s_address, s_size)
+        if s_mode == 'promote':
+            self.promoted[s_key] = s_cell
+        try:
+            self.flatten(body, ast.children['body'])
+            axe.peephole.Peephole(self, self.profile).fuse(body)
+            self.trace(body)
+        finally:
+            self.promoted.pop(s_key, None)
+        l_body = self._body(body, ast.children['body'])
+        
+        if s_mode == 'promote':
+            s_first = s_start % 256 ** s_size
+            s_range = xrange(s_first, s_end + 1, s_increment)
+            s_last = s_first + len(s_range) * s_increment
+            def l_fast_for(other):
+                for s_value in s_range:
+                    s_cell[0] = s_value
+                    l_body()
+                calc_set_var(s_address, s_last)
+                return 0
+        else:
+            def l_fast_for(other):
+                calc_set_var(s_address, s_start)
+                while calc_get_var(s_address) <= s_end:
+                    l_body()
+                    calc_set_var(s_address, calc_get_var(s_address) + s_increment)
+                return 0
+        
+        code.append(l_fast_for)
+        return lambda other: 0
+    
+    def _body(self, body, ast):
+        """Returns a function which runs all of 'body' (a Code object for the
+        block 'ast') from the start."""
+        s_straight = True
+        for child in ast.children:
+            if child.name in BRANCHES:
+                if child.name != 'for' or not self.fast_for_mode(child):
+                    s_straight = False
+        
+        if s_straight:
+            # Nothing can jump, so every line runs once, in order.
+            s_lines = tuple(body.code)
+            def l_body():
+                for l_line in s_lines:
+                    l_line(body)
+                return
+        else:
+            s_lines = body.code
+            s_end = len(s_lines)
+            def l_body():
+                s_token = 0
+                while s_token < s_end:
+                    body.next_token = s_token + 1
+                    s_lines[s_token](body)
+                    s_token = body.next_token
+                return
+        return l_body
             
     
     
@@ -325,6 +661,9 @@ class Interpreter(object):
             return 0
         
         code.replace(s_start, l_check_if)
+        code.describe(s_start, 'compare_jump', 
+            condition=ast.children['condition'], target=s_end + 1, 
+            jump_if=False, returns=0)
         
         return lambda other: 0
     
@@ -350,6 +689,9 @@ class Interpreter(object):
         
         code.replace(s_start, l_check_ifelse)
         code.replace(s_jump, l_jump_ifelse)
+        code.describe(s_start, 'compare_jump', 
+            condition=ast.children['condition'], target=s_jump + 1, 
+            jump_if=False, returns=0)
         
         return lambda other: 0
         
@@ -359,29 +701,163 @@ class Interpreter(object):
         return lambda other: code.counter + 1
     
     def _goto(self, code, ast):
-        l_target = ast.children['target']
-        if isinstance(l_target, basestring):
-            def l_goto1(other):
-                other.jump(other.get_label(l_target))
-                return other.next_token
-            return l_goto1
+        s_name = ast.children['target']
+        if isinstance(s_name, basestring):
+            # Replaced by a direct jump once the label is found (see 
+            # Code.link).
+            s_line = code.counter + 1
+            def l_goto_missing(other):
+                raise MissingLabelException('Missing label: ' + str(s_name))
+            def resolve(s_target):
+                def l_goto1(other):
+                    other.next_token = s_target
+                    return s_target
+                code.replace(s_line, l_goto1)
+                return
+            code.add_fixup(s_name, resolve)
+            return l_goto_missing
         else:
+            l_target = self.flatten(code, s_name)
+            s_targets = code.targets
             def l_goto2(other):
-                s_target = l_target(other)
-                other.jump(s_target)
-                return other.next_token
+                address = l_target(other)
+                try:
+                    line = s_targets[address]
+                except KeyError:
+                    raise InvalidJumpException(
+                        'Goto does not point at a label: ' + str(address))
+                other.next_token = line
+                return line
             return l_goto2
         return
     
+    def is_call(self, ast):
+        return isinstance(ast, axe.parser.Node) and ast.name == 'call'
+    
+    def _call(self, code, ast, s_jump=False):
+        """
+        Calls a subroutine: 'sub(LBL, ...)'.
+        
+        The arguments are stored in r1 to r6, and the line to come back to is
+        pushed onto code.returns, which 'Return' pops off again.
+        
+        A call on a line of its own just jumps to the label, so that calling
+        costs little more than a Goto.  A call inside an expression needs the
+        value the subroutine returns (the value of the last line it ran 
+        before returning), so it runs the subroutine in a loop of its own 
+        until it returns.
+        """
+        s_name = ast.children['target']
+        l_args = [self.flatten(code, arg) for arg in ast.children['args'].children]
+        if len(l_args) > 6:
+            raise AxeRuntimeError('A subroutine takes at most 6 arguments')
+        s_registers = [axe.parser.Pointer.constants['R_VARS'] + 2 * i 
+                       for i in range(len(l_args))]
+        set_var_2 = self.bindings.set_var_2
+        
+        s_cell = [None]
+        def resolve(s_target):
+            s_cell[0] = s_target
+            return
+        code.add_fixup(s_name, resolve)
+        
+        def enter(other):
+            target = s_cell[0]
+            if target is None:
+                raise MissingLabelException('Missing label: ' + str(s_name))
+            # Every argument is worked out before any are stored, since they
+            # may use r1 to r6 themselves.
+            values = [l_arg(other) for l_arg in l_args]
+            for address, value in zip(s_registers, values):
+                set_var_2(address, value)
+            other.returns.append(other.next_token)
+            other.next_token = target
+            return
+        
+        if s_jump:
+            def l_call(other):
+                enter(other)
+                return 0
+            return l_call
+        
+        def l_call(other):
+            enter(other)
+            returns = other.returns
+            s_depth = len(returns)
+            lines = other.code
+            out = value = 0
+            while len(returns) >= s_depth:
+                token = other.next_token
+                if token >= len(lines):
+                    # The program ended without returning.
+                    del returns[s_depth - 1:]
+                    break
+                other.next_token = token + 1
+                value = out
+                out = lines[token](other)
+            if value is None:
+                return 0
+            return value
+        return l_call
+    
+    def _return(self, code, ast):
+        def l_return(other):
+            if other.returns:
+                other.next_token = other.returns.pop()
+            else:
+                # Returning from the program itself ends it.
+                other.next_token = len(other.code)
+            return 0
+        return l_return
+    
     def _get_label(self, code, ast):
-        s_target = ast.children[0] # Gets a string, not another node
+        s_name = ast.children[0] # Gets a string, not another node
+        s_cell = [None]
+        def resolve(s_target):
+            s_cell[0] = s_target
+            return
+        code.add_fixup(s_name, resolve)
         def l_get_label(other):
-            return other.get_label(s_target)
+            if s_cell[0] is None:
+                raise MissingLabelException('Missing label: ' + str(s_name))
+            return s_cell[0]
         return l_get_label
         
 
     ### Drawing ###
-    def pxl_commands(self, code, ast, drawing_func):
+    def _guard(self, ast, l_draw):
+        """
+        Wraps a drawing command, so that the variables A to Z (which are
+        kept out of memory while the program runs; see 'axe/registers.py')
+        are written to memory first if the command might read them, and read
+        back afterwards if it might have changed them.
+
+        DispGraph always writes them out first, so that anything else
+        watching memory sees them once per frame.
+        """
+        registers = self.registers
+        s_overlaps = False
+        for address in axe.registers.buffers(ast):
+            s_address = axe.peephole.constant(address)
+            if axe.registers.overlaps(s_address, axe.registers.BUFFER_SIZE):
+                s_overlaps = True
+
+        if s_overlaps:
+            def l_guarded(other):
+                registers.store()
+                s_out = l_draw(other)
+                registers.load()
+                return s_out
+        elif ast.name == 'dispgraph':
+            def l_guarded(other):
+                registers.store()
+                return l_draw(other)
+        else:
+            return l_draw
+        return l_guarded
+
+    def pxl_commands(self, code, ast, s_name):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         l_x = self.flatten(code, ast.start_x)
         l_y = self.flatten(code, ast.start_y)
@@ -391,20 +867,21 @@ class Interpreter(object):
             s_x = l_x(other)
             s_y = l_y(other)
             s_coords = (s_x, s_y)
-            drawing_func(s_buffer, s_coords, s_size)
+            getattr(s_bindings, s_name)(s_buffer, s_coords, s_size)
             return 1
         return l_pxl
     
     def _pxl_on(self, code, ast):
-        return self.pxl_commands(code, ast, self.calculator.rect)
+        return self.pxl_commands(code, ast, 'rect')
 
     def _pxl_off(self, code, ast):
-        return self.pxl_commands(code, ast, self.calculator.clear_rect)
+        return self.pxl_commands(code, ast, 'clear_rect')
     
     def _pxl_change(self, code, ast):
-        return self.pxl_commands(code, ast, self.calculator.inverse_rect)
+        return self.pxl_commands(code, ast, 'inverse_rect')
     
     def _pxl_test(self, code, ast):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         l_x = self.flatten(code, ast.start_x)
         l_y = self.flatten(code, ast.start_y)
@@ -413,26 +890,29 @@ class Interpreter(object):
             s_buffer = l_buffer(other)
             s_x = l_x(other)
             s_y = l_y(other)
-            return self.calculator.pxl_get(s_buffer, (s_x, s_y))
+            return s_bindings.pxl_get(s_buffer, (s_x, s_y))
         return l_pxl_test
         
     def _vertical(self, code, ast): # not working
+        s_bindings = self.bindings
         s_direction = ast.children[0]
         l_buffer = self.flatten(code, ast.children[1])
         def l_vertical(other):
-            self.calculator.shift_buffer_vertical(l_buffer(other), s_direction)
+            s_bindings.shift_buffer_vertical(l_buffer(other), s_direction)
             return
         return l_vertical
     
     def _horizontal(self, code, ast): # not working
+        s_bindings = self.bindings
         s_direction = ast.children[0]
         l_buffer = self.flatten(code, ast.children[1])
         def l_horizontal(other):
-            self.calculator.shift_buffer_horizontal(l_buffer(other), s_direction)
+            s_bindings.shift_buffer_horizontal(l_buffer(other), s_direction)
             return
         return l_horizontal
     
-    def rect_commands(self, code, ast, drawing_func):
+    def rect_commands(self, code, ast, s_name):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         l_x = self.flatten(code, ast.start_x)
         l_y = self.flatten(code, ast.start_y)
@@ -442,17 +922,18 @@ class Interpreter(object):
             s_buffer = l_buffer(other)
             s_coords = (l_x(other), l_y(other))
             s_size = (l_width(other), l_height(other))
-            drawing_func(s_buffer, s_coords, s_size)
+            getattr(s_bindings, s_name)(s_buffer, s_coords, s_size)
             return 1
         return l_rect
         
     def _rect(self, code, ast):
-        return self.rect_commands(code, ast, self.calculator.rect)
+        return self.rect_commands(code, ast, 'rect')
         
     def _recti(self, code, ast):
-        return self.rect_commands(code, ast, self.calculator.inverse_rect)
+        return self.rect_commands(code, ast, 'inverse_rect')
     
     def _circle(self, code, ast):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         l_x = self.flatten(code, ast.start_x)
         l_y = self.flatten(code, ast.start_y)
@@ -461,11 +942,12 @@ class Interpreter(object):
             s_buffer = l_buffer(other)
             s_coords = (l_x(other), l_y(other))
             s_radius = l_radius(other)
-            self.calculator.circle(s_buffer, s_coords, s_radius)
+            s_bindings.circle(s_buffer, s_coords, s_radius)
             return 1
         return l_circle
     
     def _draw_line(self, code, ast):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         l_start_x = self.flatten(code, ast.start_x)
         l_start_y = self.flatten(code, ast.start_y)
@@ -475,11 +957,12 @@ class Interpreter(object):
             s_buffer = l_buffer(other)
             s_start = (l_start_x(other), l_start_y(other))
             s_end = (l_end_x(other), l_end_y(other))
-            self.calculator.line(s_buffer, s_start, s_end)
+            s_bindings.line(s_buffer, s_start, s_end)
             return 1
         return l_draw_line
 
     def _dispgraph(self, code, ast):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         s_state = ast.kwargs['state'].value
         if s_state > 2:
@@ -487,20 +970,21 @@ class Interpreter(object):
             def l_dispgraph(other):
                 s_buffer = l_buffer(other)
                 s_backbuffer = l_backbuffer(other)
-                self.calculator.disp_screen(s_buffer, s_backbuffer, s_state)
+                s_bindings.disp_screen(s_buffer, s_backbuffer, s_state)
                 return
         else:
             def l_dispgraph(other):
                 s_buffer = l_buffer(other)
-                self.calculator.disp_screen_mono(s_buffer)
+                s_bindings.disp_screen_mono(s_buffer)
                 return
         return l_dispgraph
     
     def _clrdraw(self, code, ast):
+        s_bindings = self.bindings
         l_buffer = self.flatten(code, ast.buf.address)
         def l_clrdraw(other):
             s_buffer = l_buffer(other)
-            self.calculator.clear_rect(s_buffer, (0,0), (96,64))
+            s_bindings.clear_rect(s_buffer, (0,0), (96,64))
             return 1
         return l_clrdraw
         
@@ -516,13 +1000,14 @@ class Interpreter(object):
         return l_disp
     
     def _getkey(self, code, ast):
+        s_bindings = self.bindings
         l_number = self.flatten(code, ast.number)
         def l_getkey(other):
             s_number = l_number(other)
             if s_number:
-                return self.calculator.is_key_pressed(s_number)
+                return s_bindings.is_key_pressed(s_number)
             else:
-                return self.calculator.is_any_key_pressed()
+                return s_bindings.is_any_key_pressed()
             return
         return l_getkey
     
@@ -562,12 +1047,75 @@ class Interpreter(object):
             webbrowser.open(os.path.realpath(r"readme/index.html"), 2)
             return 1
         return l_help
-        
+
+
+class Bindings(object):
+    """
+    The methods and memory of the calculator an Interpreter runs on, looked
+    up once instead of on every line.
+
+    Closures hold on to the Bindings object, not to what's inside it, so
+    'update' can point all of them at a different calculator (or at new
+    memory, since Calculator.init replaces it) without compiling anything
+    again.
+
+    get_var_1 and friends work like the calculator's methods of the same
+    name, but index memory directly.
+    """
+    METHODS = ('rect', 'clear_rect', 'inverse_rect', 'pxl_get', 'circle',
+               'line', 'disp_screen', 'disp_screen_mono',
+               'shift_buffer_vertical', 'shift_buffer_horizontal',
+               'is_key_pressed', 'is_any_key_pressed')
+
+    def __init__(self, calculator):
+        self.calculator = None
+        self.memory = None
+        self.update(calculator)
+        return
+
+    def update(self, calculator):
+        """Binds everything to 'calculator' again, if either it or its
+        memory has changed since the last time."""
+        # Memory doesn't exist until the calculator's 'init' is called.
+        memory = getattr(calculator, '_memory', None)
+        if calculator is self.calculator and memory is self.memory:
+            return
+        self.calculator = calculator
+        self.memory = memory
+        for name in self.METHODS:
+            setattr(self, name, getattr(calculator, name))
+        return
+
+    def get_var_1(self, location):
+        return self.memory[location]
+
+    def get_var_2(self, location):
+        memory = self.memory
+        return memory[location] + memory[location + 1] * 256
+
+    def set_var_1(self, location, value):
+        self.memory[location] = value % 256
+        return value
+
+    def set_var_2(self, location, value):
+        value = value % 65536
+        memory = self.memory
+        memory[location] = value % 256
+        memory[location + 1] = value // 256
+        return value
+
+
 class Code(object):
     def __init__(self):
         self.code = []
         self.data = []
         self.labels = {}
+        self.returns = []
+        self.fixups = {}
+        self.targets = {}
+        self.descriptions = {}
+        self.fusions = {}
+        self.loops = {}
         self._counter = [-1]
         self.next_token = 0
         self.ans = 0
@@ -582,6 +1130,19 @@ class Code(object):
         self.code[value] = line
         return
     
+    def describe(self, line, pattern, **info):
+        """Records what the closure at a given line does, so that later
+        passes (see 'axe/peephole.py') can recognize and replace it."""
+        self.descriptions[line] = (pattern, info)
+        return
+    
+    def add_loop(self, line, **info):
+        """Records that the jump at 'line' goes back to the top of a loop, 
+        so that the loop can be compiled once it's hot (see 'axe/jit.py').
+        """
+        self.loops[line] = info
+        return
+    
     def internal_replace(self, line):
         """For replacing a function during runtime inside of itself.
         (The function can calculate certain, constant values at runtime,
@@ -591,13 +1152,18 @@ class Code(object):
         return
     
     def next(self):
-        try:
-            out = self.code[self.next_token]
-        except IndexError:
+        """Returns the next line and moves the counter past it, or returns
+        None if the program has halted."""
+        if self.halted:
             return None
+        out = self.code[self.next_token]
         self.next_token += 1
         return out
     
+    def _is_halted(self):
+        return self.next_token >= len(self.code)
+    halted = property(_is_halted)
+    
     def jump(self, line=0):
         self.next_token = line
         return
@@ -618,6 +1184,30 @@ class Code(object):
         if name not in self.labels:
             raise MissingLabelException('Missing label: ' + str(name))
         return self.labels[name]
+    
+    def add_fixup(self, name, resolve):
+        """Calls 'resolve' with the line of the label 'name' once it's known
+        (see 'link')."""
+        self.fixups.setdefault(name, []).append(resolve)
+        return
+    
+    def link(self):
+        """
+        Resolves every reference to a label which has been added so far, 
+        including ones from before the label itself, and updates the table 
+        which computed gotos use to find the line of a label from its 
+        address.
+        
+        References to labels which don't exist yet are kept, and resolved 
+        by a later call if they're added afterwards.
+        """
+        for name in self.fixups.keys():
+            if name in self.labels:
+                for resolve in self.fixups.pop(name):
+                    resolve(self.labels[name])
+        for line in self.labels.values():
+            self.targets[line] = line
+        return
         
     def _get_counter(self):
         return self._counter[-1]
@@ -632,12 +1222,127 @@ class Code(object):
                 return True
         return False
         
+class Session(object):
+    """
+    An interactive program which grows a few lines at a time.
+    
+    Every piece of text fed in is lexed, parsed and compiled once, then added
+    to the end of a single Code object and run from there.  Lines which were
+    entered earlier are never touched again, so labels (and the variables 
+    and memory they use) carry over from one input to the next, and the 
+    cost of each input doesn't grow with the length of the session.
+    
+    Input which leaves an If/While/Repeat/For block open is held back until
+    the End which closes it arrives.
+    
+    Parameters:
+    interpreter
+        An Interpreter, which has already been started.  Other backends 
+        (which can't add to code they've already compiled) run each input
+        on its own instead.
+    lexer
+        Any lexer with the same interface as ply's (see 'axe/tokenizer.py').
+    parser
+        A parser, as made by 'axe.parser.build'.
+    cache=None
+        A ParseCache (see 'axe/cache.py') for programs read from files.
+    """
+    OPENERS = ('IF', 'WHILE', 'REPEAT', 'FOR')
+    
+    def __init__(self, interpreter, lexer, parser, cache=None):
+        self.interpreter = interpreter
+        self.lexer = lexer
+        self.parser = parser
+        self.cache = cache
+        self.code = Code()
+        self.pending = []
+        self.depth = 0
+        return
+    
+    def _get_prompt(self):
+        if self.depth > 0:
+            return '...> '
+        return 'axe> '
+    prompt = property(_get_prompt)
+    
+    def feed(self, text):
+        """
+        Adds 'text' to the program and runs it.  Returns False (without 
+        running anything) if it's waiting for blocks to be closed.
+        """
+        if text[-1] not in ('\n', ':'):
+            text += '\n'
+        self.lexer.input(text)
+        for token in iter(self.lexer.token, None):
+            if token.type in self.OPENERS:
+                self.depth += 1
+            elif token.type == 'END':
+                self.depth -= 1
+            self.pending.append(token)
+        if self.depth > 0:
+            return False
+        
+        tokens = iter(self.pending)
+        self.pending = []
+        self.depth = 0
+        ast = self.parser.parse(
+            lexer=self.lexer, tokenfunc=lambda: next(tokens, None))
+        self.run(ast)
+        return True
+    
+    def feed_file(self, source):
+        """Adds the program in the file object 'source', and runs it."""
+        tokenizer = axe.tokenizer.build()
+        if self.cache:
+            ast = self.cache.parse_file(source, tokenizer, self.parser)
+        else:
+            tokenizer.input_file(source)
+            ast = self.parser.parse(lexer=tokenizer)
+        self.run(ast)
+        return
+    
+    def run(self, ast):
+        if ast is None:
+            return
+        ast = axe.optimizer.optimize(ast)
+        interpreter = self.interpreter
+        if not isinstance(interpreter, Interpreter):
+            interpreter.execute(ast)
+            return
+        
+        code = self.code
+        start = len(code.code)
+        interpreter.compile(ast, code)
+        code.jump(start)
+        interpreter.run(code)
+        print('... ', code.ans)
+        if interpreter.profile:
+            print(axe.peephole.report(code))
+        return
+        
 _thread_text = ''
 
-def test(lexer=None, parser=None, 
-         calculator=axe.calculator.Calculator(), text=''):
+def test(lexer=None, parser=None, calculator=None, text='', backend=None,
+         profile=False, cache=None, source=None):
     """
     This tests the interpreter.
+    
+    'backend' can be any class with the same interface as Interpreter (for
+    example, 'axe.bytecode.BytecodeInterpreter').  Defaults to Interpreter.
+    
+    If 'profile' is True, a report of which lines were fused into 
+    superinstructions (see 'axe/peephole.py') is printed after each run.
+    
+    If 'cache' is given (see 'axe.cache.ParseCache'), a program read from
+    'source' is loaded from it if it was parsed before.
+    
+    Everything typed in is added to the same program (see 'Session'), so a 
+    Goto can jump to a label from an earlier line, and a block can be typed
+    over several lines.
+    
+    If 'source' is given, it should be a file object holding a program to 
+    run first.  It's lexed a chunk at a time (see 'axe/tokenizer.py') rather
+    than being read into memory all at once.
     """
     global _thread_text
     global _draw
@@ -647,28 +1352,33 @@ def test(lexer=None, parser=None,
         lexer = axe.lexer.build()
     if not parser:
         parser = axe.parser.build()
+    if not calculator:
+        calculator = axe.calculator.Calculator()
+    
+    if not backend:
+        backend = Interpreter
+    
+    interpreter = backend(calculator, profile)
+    interpreter.start()
+    session = Session(interpreter, lexer, parser, cache)
     
     class _console_thread(threading.Thread):
         def run(self):
             global _thread_text
             lock = threading.Lock()
             with lock:
-                _thread_text = raw_input('axe> ').strip()
+                _thread_text = raw_input(session.prompt).strip()
             return
     
-    interpreter = Interpreter(calculator)
-    interpreter.start()
-    
     while True:
-        if text:
-            if text[-1] not in ('\n', ':'):
-                text += '\n'
-            result = parser.parse(text, lexer=lexer)
-            
-            try:
-                interpreter.execute(result)
-            except AxeRuntimeError, e:
-                print('Runtime error: ', e)
+        try:
+            if source:
+                session.feed_file(source)
+                source = None
+            elif text:
+                session.feed(text)
+        except AxeRuntimeError, e:
+            print('Runtime error: ', e)
         
         try:
             _thread_text = ''
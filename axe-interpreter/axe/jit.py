@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+import axe.parser
+import axe.peephole
+import axe.registers
+import axe.codegen
+
+a = """
+Compiles loops which run often into Python functions while the program is
+running.
+
+The Interpreter (see 'axe/interpreter.py') records every While, Repeat and
+For loop it flattens with Code.add_loop.  After the code is linked and
+fused, the jump at the bottom of each loop is wrapped so that it counts how
+many times it runs.  Once a loop has gone around HOT_LOOP times, its part of
+the tree is turned into a Python function by the code generator (see
+'axe/codegen.py'), and the line at the top of the loop is replaced with a
+closure which calls that function and then jumps past the end of the loop.
+From then on, the whole loop runs as native Python, and the closures for its
+body are never called again.
+
+Loops are compiled lazily, so code which only runs a few times never pays
+for it.  Loops holding a label, a Goto, a sub( or a Return are left alone,
+since they can jump somewhere the compiled function can't follow.  Inner
+loops usually become hot first, and are compiled again as part of their
+outer loop once that becomes hot too.
+
+The compiled function reads and writes memory directly, so the variables it
+uses (see 'axe/registers.py') are written to memory before it runs and read
+back afterwards.
+"""
+
+# How many times the bottom of a loop has to run before it's compiled.
+HOT_LOOP = 64
+
+# Loops holding any of these are never compiled.  The first five can jump
+# out of the loop, and the code generator skips the last two.
+UNTRACEABLE = ('label', 'goto', 'get_label', 'call', 'return', 
+               'horizontal', 'vertical')
+
+
+class LoopGenerator(axe.codegen.CodeGenerator):
+    """
+    Generates the source of a function which runs the rest of a single loop.
+
+    The loop is picked up from where the interpreter left off, so unlike
+    CodeGenerator, For loops don't set the loop variable to its start first.
+    """
+    def generate_loop(self, ast, entry='head'):
+        """
+        Returns the source of a function named 'axe_loop'.
+
+        'entry' is where the loop is entered:
+
+        'head'
+            At the condition, as when the loop is first reached.
+        'body'
+            At the top of the body, after the condition has already passed.
+            Only used for For loops, whose last line jumps straight there.
+        """
+        self.lines = []
+        self.indent = 1
+        self.temp_counter = 0
+        self.write('out = None')
+        if ast.name == 'for':
+            self._loop_for(ast, entry)
+        else:
+            self.statement(ast)
+        self.write('return out')
+        header = 'def axe_loop({0}):'.format(
+            ', '.join(axe.codegen.RUNTIME_NAMES))
+        return '\n'.join([header] + self.lines) + '\n'
+
+    def _loop_for(self, ast, entry):
+        pointer = ast.children['pointer']
+        load = self.expression(pointer)
+        end = self.expression(ast.children['end'])
+        update = self.store(pointer, '{0} + {1}'.format(
+            load, self.expression(ast.children['increment'])))
+        if entry == 'head':
+            self.write('while not {0} > {1}:'.format(load, end))
+            self.body(ast.children['body'])
+            self.indent += 1
+            self.write(update)
+            self.indent -= 1
+        else:
+            self.write('while True:')
+            self.body(ast.children['body'])
+            self.indent += 1
+            self.write(update)
+            self.write('if {0} > {1}:'.format(load, end))
+            self.indent += 1
+            self.write('break')
+            self.indent -= 2
+        return
+
+
+class Tracer(object):
+    """
+    Counts how often the loops in a Code object run, and compiles the ones
+    which become hot.
+
+    If 'profile' is True, every compiled loop counts how often it's entered,
+    and the counts are included in 'axe.peephole.report' as 'hot_loop'.
+    """
+    def __init__(self, interpreter, profile=False):
+        self.interpreter = interpreter
+        self.bindings = interpreter.bindings
+        self.registers = interpreter.registers
+        self.profile = profile
+        self.generator = LoopGenerator()
+        return
+
+    def install(self, code):
+        for line, info in sorted(code.loops.items()):
+            if self.is_traceable(info['ast']):
+                code.replace(line, self.counter(code, line, **info))
+        # Loops added to the code later on are installed by themselves.
+        code.loops.clear()
+        return code
+
+    def is_traceable(self, ast):
+        """
+        Checks if a loop can be compiled: nothing in it may jump, and every
+        For loop in it (including itself) needs a fixed loop variable and 
+        increment.  Otherwise, the interpreter works those out only once 
+        (see Interpreter._for), while the generated code would work them out 
+        on every pass.
+        """
+        for node in axe.parser.nodes(ast):
+            if node.name in UNTRACEABLE:
+                return False
+            if node.name != 'for':
+                continue
+            pointer = node.children['pointer']
+            if axe.peephole.constant(pointer.address) is None:
+                return False
+            if axe.peephole.constant(node.children['increment']) is None:
+                return False
+        return True
+
+    def counter(self, code, line, ast, head, exit, returns, body=None):
+        """
+        Wraps the jump at the bottom of a loop (at 'line') with one which
+        counts how often it runs, and compiles the loop once it's hot.
+
+        'head' is the line at the top of the loop, 'exit' the line after
+        it, and 'body' (For loops only) the first line of the body.
+        'returns' is what the line at the top would have returned.
+        """
+        l_edge = code.code[line]
+        s_count = [0]
+        def l_count_edge(other):
+            out = l_edge(other)
+            s_count[0] += 1
+            if s_count[0] < HOT_LOOP:
+                return out
+            # Either way, this line doesn't need counting any more.
+            code.replace(line, l_edge)
+            try:
+                l_head = self.compile(code, ast, 'head', exit, returns)
+                if body is not None:
+                    l_body = self.compile(code, ast, 'body', exit, returns)
+            except axe.codegen.CodegenError:
+                return out
+            code.replace(head, l_head)
+            if other.next_token == body:
+                # The last line of a For loop jumps straight back into the
+                # body, so the rest of the loop has to start from there.
+                return l_body(other)
+            return out
+        return l_count_edge
+
+    def compile(self, code, ast, entry, exit, returns):
+        """Returns a closure which runs the rest of the loop 'ast' as a
+        Python function, and then jumps to 'exit'."""
+        source = self.generator.generate_loop(ast, entry)
+        function = axe.codegen.compile_function(source, 'axe_loop')
+        bindings = self.bindings
+        registers = self.registers
+        s_used = axe.registers.used(ast)
+        s_runtime = axe.codegen.runtime(bindings.calculator)
+
+        def l_loop(other):
+            if s_runtime['m'] is not bindings.memory:
+                # The calculator (or its memory) was replaced since this was
+                # compiled.
+                s_runtime.update(axe.codegen.runtime(bindings.calculator))
+            registers.store(s_used)
+            try:
+                function(**s_runtime)
+            finally:
+                registers.load(s_used)
+            other.next_token = exit
+            return returns
+
+        if entry == 'head':
+            stats = code.fusions.setdefault(
+                'hot_loop', {'sites': 0, 'hits': [0]})
+            stats['sites'] += 1
+            if self.profile:
+                l_loop = self.count(l_loop, stats['hits'])
+        return l_loop
+
+    def count(self, l_loop, hits):
+        def l_counted(other):
+            hits[0] += 1
+            return l_loop(other)
+        return l_counted
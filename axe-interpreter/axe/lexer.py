@@ -8,6 +8,11 @@ Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
 License: GNU Lesser GPL
 """
 
+import os.path
+import sys
+import types
+import hashlib
+
 ## 3rd party modules ##
 import ply.lex
 
@@ -47,7 +52,9 @@ reserved = {
     'Vertical' : 'VERTICAL',
     'DiagnosticOn' : 'DIAGNOSTICON',
     'DiagnosticOff' : 'DIAGNOSTICOFF',
-    'DrawInv' : 'DRAWINV'
+    'DrawInv' : 'DRAWINV',
+    'sub' : 'SUBROUTINE',
+    'Return' : 'RETURN'
 }
 
 # Tokens:
@@ -200,7 +207,7 @@ def t_PXL_CHANGE(t):
     return t
 
 def t_VAR(t):
-    r'\b[A-Z]\b'
+    r'\b[A-Z]\b|\br[1-6]\b'
     t.value = 'VAR_' + t.value
     return t
 
@@ -284,7 +291,10 @@ def t_ID(t):
     return t
 
 def t_COMMENT(t):
-    r'(\..*)|(\.\.\.\n.*\n\.\.\.)'
+    r'(\.\.\.\n([\s\S]*?\n)??\.\.\.)|(\..*)'
+    # Block comments (from a '...' to the next line starting with '...') 
+    # come first, so that they aren't mistaken for single line comments.
+    t.lexer.lineno += t.value.count('\n')
     pass    # No return value.
 
 def t_error(t):
@@ -310,8 +320,57 @@ def find_column(input_str, token):
     
     
     
+# The tables ply builds from the rules above are cached in this module, next
+# to this file, so that they don't have to be rebuilt on every startup.
+LEXTAB = 'axe.lextab'
+
+def signature():
+    """
+    Returns a hash of everything the lexer tables are built from: the 
+    tokens, the reserved words, every rule (along with its line number, since
+    ply orders rules by it), and the version of ply.
+    """
+    module = sys.modules[__name__]
+    rules = []
+    for name in sorted(dir(module)):
+        if not name.startswith('t_'):
+            continue
+        rule = getattr(module, name)
+        if isinstance(rule, types.FunctionType):
+            rules.append((name, rule.__doc__, rule.func_code.co_firstlineno))
+        else:
+            rules.append((name, rule))
+    info = (ply.lex.__version__, tokens, sorted(reserved.items()), rules)
+    return hashlib.md5(repr(info)).hexdigest()
+
 def build(**kwargs):
-    return ply.lex.lex(debug=0, **kwargs)
+    """
+    Returns a new lexer.
+    
+    The lexer is loaded from the cached tables in LEXTAB if they're up to 
+    date.  Otherwise, it's built from scratch (checking every rule) and the
+    tables are saved for next time.
+    """
+    module = sys.modules[__name__]
+    current = signature()
+    try:
+        import axe.lextab
+        if axe.lextab._signature != current:
+            raise ImportError('Lexer tables are out of date')
+        return ply.lex.lex(
+            module=module, optimize=1, lextab=axe.lextab, **kwargs)
+    except (ImportError, AttributeError):
+        pass
+    
+    lexer = ply.lex.lex(module=module, debug=0, **kwargs)
+    outputdir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        lexer.writetab(LEXTAB, outputdir)
+        with open(os.path.join(outputdir, 'lextab.py'), 'a') as lextab:
+            lextab.write('_signature = {0!r}\n'.format(current))
+    except IOError:
+        pass    # The tables are only a cache.
+    return lexer
     
 
 def test(text):
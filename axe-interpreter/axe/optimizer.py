@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+import axe.parser
+from axe.parser import Expression, Operation
+
+a = """
+Takes an abstract syntax tree and returns a simpler one which does the same
+thing.
+
+This step sits between the Parser (see 'axe/parser.py') and whatever runs
+the program (see 'axe/interpreter.py'), so that work which only depends on
+constants is done once instead of every time a line runs.
+"""
+
+# Operations where 'a op b op c' can have the constants collected together.
+# Subtraction counts because 'a - b - c' is 'a - (b + c)'.
+CHAINABLE = {
+    'add': 'add',
+    'mul': 'mul',
+    'sub': 'add'
+}
+
+# Replacing 'x op 2**n' with something cheaper.  These hold for negative
+# numbers too, since Python's '//', '%' and '>>' all round towards negative
+# infinity.
+STRENGTH_REDUCTIONS = {
+    'mul': ('lshift', lambda n: n.bit_length() - 1),
+    'div': ('rshift', lambda n: n.bit_length() - 1),
+    'mod': ('and_', lambda n: n - 1)
+}
+
+
+class Optimizer(object):
+    """
+    Simplifies an abstract syntax tree.
+
+    Currently, this:
+
+    -   Folds operations on constants (including pointers to fixed
+        addresses, like variables or 'L1 + 3') into a single number.
+    -   Collects the constants in chains like 'A + 1 + 2' together.
+    -   Replaces multiplying, dividing, or modding by a power of two with
+        shifts and masks.
+    -   Removes If/While/Repeat blocks that can never run, and the test for
+        ones which always run.
+
+    The tree is modified in place where possible, and the new root is
+    returned.
+    """
+    def optimize(self, ast):
+        if not isinstance(ast, axe.parser.Node):
+            return ast
+        method = getattr(self, '_' + ast.name, self.generic)
+        return method(ast)
+
+    def generic(self, ast):
+        for name, item in vars(ast).items():
+            if isinstance(item, axe.parser.Node):
+                setattr(ast, name, self.optimize(item))
+            elif isinstance(item, list):
+                item[:] = [self.optimize(child) for child in item]
+            elif isinstance(item, dict):
+                for key in item:
+                    item[key] = self.optimize(item[key])
+        return ast
+
+    def constant(self, ast):
+        if type(ast) == Expression and type(ast.value) in (int, long):
+            return ast.value
+        return None
+
+    def has_label(self, ast):
+        for node in axe.parser.nodes(ast):
+            if node.name == 'label':
+                return True
+        return False
+
+    ### Expressions ###
+
+    def _operation(self, ast):
+        args = [self.optimize(arg) for arg in ast.args]
+        op = ast.op
+
+        # Turn '(a + b) + c' into 'a + b + c' so the constants meet.
+        if op in CHAINABLE:
+            while isinstance(args[0], Operation) and args[0].op == op:
+                args = args[0].args + args[1:]
+
+        if op in CHAINABLE and len(args) > 2:
+            head = []
+            if op == 'sub':
+                head, args = args[:1], args[1:]
+            values = [self.constant(arg) for arg in args]
+            variables = [arg for (arg, v) in zip(args, values) if v is None]
+            numbers = [v for v in values if v is not None]
+            if len(numbers) >= 2:
+                combined = Operation(CHAINABLE[op], *[Expression(n) for n in numbers])
+                args = head + variables + [Expression(combined.resolve())]
+            else:
+                args = head + args
+
+        folded = Operation(op, *args)
+        value = folded.resolve()
+        if value is not None:
+            return Expression(value)
+        return self.reduce_strength(folded)
+
+    def reduce_strength(self, ast):
+        if ast.op not in STRENGTH_REDUCTIONS:
+            return ast
+        n = self.constant(ast.args[-1])
+        if n is None or n < 2 or n & (n - 1):
+            return ast
+        op, convert = STRENGTH_REDUCTIONS[ast.op]
+        if len(ast.args) == 2:
+            left = ast.args[0]
+        else:
+            left = Operation(ast.op, *ast.args[:-1])
+        return Operation(op, left, Expression(convert(n)))
+
+    def _pointer(self, ast):
+        ast.address = self.optimize(ast.address)
+        return ast
+
+    ### Control structures ###
+
+    def _if(self, ast):
+        self.generic(ast)
+        condition = self.constant(ast.children['condition'])
+        if condition is None or self.has_label(ast):
+            return ast
+        if condition:
+            return ast.children['body']
+        return None
+
+    def _if_else(self, ast):
+        self.generic(ast)
+        condition = self.constant(ast.children['condition'])
+        if condition is None or self.has_label(ast):
+            return ast
+        if condition:
+            return ast.children['body'].children[0]
+        return ast.children['body'].children[1]
+
+    def _while(self, ast):
+        self.generic(ast)
+        condition = self.constant(ast.children['condition'])
+        if condition == 0 and not self.has_label(ast):
+            return None
+        return ast
+
+    def _repeat(self, ast):
+        self.generic(ast)
+        condition = self.constant(ast.children['condition'])
+        if condition and not self.has_label(ast):
+            return None
+        return ast
+
+
+def optimize(ast):
+    return Optimizer().optimize(ast)
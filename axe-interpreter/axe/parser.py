@@ -136,19 +136,25 @@ class Operation(Expression):
         return
     
     def resolve(self):
+        """Returns the value of the operation if every argument is a
+        constant, or None."""
         resolved_args = []
         for arg in self.args:
-            if isinstance(arg, Expression):
+            if isinstance(arg, Operation):
+                test = arg.resolve()
+            elif type(arg) == Expression:
                 test = arg.value
-            elif type(arg) == int:
-                test = arg
-            if type(test) != int:
+            else:
+                test = None
+            if type(test) not in (int, long):
                 return None
             resolved_args.append(test)
                 
         seed = resolved_args[0]
         for arg in resolved_args[1:]:
-            seed = getattr(operator, self.name)(seed, arg)
+            if self.op in ('div', 'mod') and arg == 0:
+                return None
+            seed = int(getattr(operator, self.op)(seed, arg))
         return seed
     
     def __repr__(self, indent=0):
@@ -315,6 +321,24 @@ class NotImplemented(Node):
         self.name = 'notimplemented'
         self.children = list(args)
         return
+
+
+def nodes(ast):
+    """Yields every node in the tree, including 'ast' itself."""
+    if isinstance(ast, list):
+        for item in ast:
+            for node in nodes(item):
+                yield node
+    elif isinstance(ast, dict):
+        for item in ast.values():
+            for node in nodes(item):
+                yield node
+    elif isinstance(ast, Node):
+        yield ast
+        for item in vars(ast).values():
+            for node in nodes(item):
+                yield node
+    return
   
 
 def debug(function, *args, **kwargs):
@@ -445,6 +469,12 @@ def p_control_goto_expression(p):
     p[0] = Line(Control('goto', target=p[3]))
     return
 
+@debug
+def p_line_return(p):
+    '''line : RETURN newline'''
+    p[0] = Line(Control('return'))
+    return
+
 
 ## Lines ##
 @debug
@@ -840,6 +870,10 @@ def p_pointer_map_var(p):
               'P', 'Q', 'R', 'S', 'T', 
               'U', 'V', 'W', 'X', 'Y', 
               'Z', 'THETA']
+    if var.startswith('r'):
+        # r1 to r6, which hold the arguments of a subroutine.
+        p[0] = Pointer((int(var[1]) - 1) * 2, 2, 'R_VARS')
+        return
     p[0] = Pointer(var_order.index(var) * 2, 2, 'AZ_VARS')
     return
 
@@ -900,6 +934,20 @@ def p_expression_label_get_address(p):
     return
 
 
+@debug
+def p_tempexpression_subroutine(p):
+    '''tempexpression : SUBROUTINE LPAREN NAME RPAREN
+                      | SUBROUTINE LPAREN NAME COMMA expression RPAREN
+                      | SUBROUTINE LPAREN NAME COMMA expression COMMA expression RPAREN
+                      | SUBROUTINE LPAREN NAME COMMA expression COMMA expression COMMA expression RPAREN
+                      | SUBROUTINE LPAREN NAME COMMA expression COMMA expression COMMA expression COMMA expression RPAREN
+                      | SUBROUTINE LPAREN NAME COMMA expression COMMA expression COMMA expression COMMA expression COMMA expression RPAREN
+                      | SUBROUTINE LPAREN NAME COMMA expression COMMA expression COMMA expression COMMA expression COMMA expression COMMA expression RPAREN'''
+    # The arguments are every other item after the name.
+    args = Node('arguments', *[p[i] for i in range(5, len(p) - 1, 2)])
+    p[0] = Expression(Control('call', target=p[3], args=args))
+    return
+
 @debug
 def p_tempexpression_getkey(p):
     '''tempexpression : GETKEY LPAREN expression RPAREN'''
@@ -990,7 +1038,13 @@ def p_id(p):
     p[0] = None
     return
 
+# How many syntax errors have been reported so far.  Callers can compare this
+# before and after parsing to tell whether the parse was clean.
+error_count = 0
+
 def p_error(t):
+    global error_count
+    error_count += 1
     try:
         info = {'lineno': t.lineno, 'value':t.value}
         print "! > Syntax error @ line {lineno}: '{value}'".format(**info)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+import operator
+
+import axe.parser
+
+a = """
+Replaces common sequences of closures in flattened code with single,
+specialized closures ("superinstructions").
+
+This runs after an Interpreter (see 'axe/interpreter.py') has flattened an
+abstract syntax tree into a Code object, and before the code runs.  The
+Interpreter marks the closures it knows can be fused with Code.describe.
+"""
+
+COMPARISONS = ('lt', 'le', 'eq', 'ne', 'gt', 'ge')
+
+
+def constant(ast):
+    if type(ast) == axe.parser.Expression and type(ast.value) == int:
+        return ast.value
+    return None
+
+
+class Peephole(object):
+    """
+    Fuses the patterns described in a Code object.
+
+    Currently, this knows about:
+
+    store
+        'X + 1 -> X' and similar: loading a variable, adding a constant to
+        it, and storing it back into the same place.
+    compare_jump
+        An If/While/Repeat whose condition is a single comparison.  The
+        comparison and the conditional jump become one closure.
+    for_tail
+        The end of a For loop with a fixed loop variable and increment.
+        Updating the variable, jumping back to the condition, and checking
+        the condition all happen in one closure, which jumps straight to
+        either the start of the body or the end of the loop.
+
+    Every fused closure replaces the first closure of its pattern, at the
+    same position, so jumps elsewhere in the code are unaffected.
+
+    If 'profile' is True, every fused closure counts how often it runs, and
+    the counts can be printed with 'report'.
+    """
+    def __init__(self, interpreter, profile=False):
+        self.interpreter = interpreter
+        self.calculator = interpreter.calculator
+        self.profile = profile
+        return
+
+    def fuse(self, code):
+        for line, (pattern, info) in sorted(code.descriptions.items()):
+            l_fused = getattr(self, '_' + pattern)(code, **info)
+            if not l_fused:
+                continue
+            stats = code.fusions.setdefault(pattern, {'sites': 0, 'hits': [0]})
+            stats['sites'] += 1
+            if self.profile:
+                l_fused = self.count(l_fused, stats['hits'])
+            code.replace(line, l_fused)
+        # Anything added to the code later on is fused by itself.
+        code.descriptions.clear()
+        return code
+
+    def count(self, l_fused, hits):
+        def l_counted(other):
+            hits[0] += 1
+            return l_fused(other)
+        return l_counted
+
+    def variable(self, pointer):
+        """Returns (address, getter, setter) for a pointer with a fixed
+        address, or None."""
+        address = constant(pointer.address)
+        if address is None:
+            return None
+        # A to Z are kept out of memory (see 'axe/registers.py').
+        get_var, set_var = self.interpreter.registers.accessors(
+            address, pointer.size)
+        return (address, get_var, set_var)
+
+    ### Patterns ###
+
+    def _store(self, code, assignment):
+        value = assignment.value
+        if not isinstance(value, axe.parser.Operation):
+            return None
+        if value.op not in ('add', 'sub') or len(value.args) != 2:
+            return None
+        source, delta = value.args
+        delta = constant(delta)
+        target = self.variable(assignment.pointer)
+        if delta is None or target is None:
+            return None
+        if not isinstance(source, axe.parser.Pointer):
+            return None
+        if (constant(source.address), source.size) != (target[0], assignment.pointer.size):
+            return None
+
+        if value.op == 'sub':
+            delta = -delta
+        s_address, get_var, set_var = target
+        def l_fused_store(other):
+            return set_var(s_address, get_var(s_address) + delta)
+        return l_fused_store
+
+    def _compare_jump(self, code, condition, target, jump_if, returns):
+        if not isinstance(condition, axe.parser.Operation):
+            return None
+        if condition.op not in COMPARISONS or len(condition.args) != 2:
+            return None
+
+        compare = getattr(operator, condition.op)
+        left, right = condition.args
+        l_left = self.interpreter.flatten(code, left)
+        s_right = constant(right)
+        l_right = self.interpreter.flatten(code, right)
+
+        if s_right is not None and jump_if:
+            def l_fused_check(other):
+                if compare(l_left(other), s_right):
+                    other.next_token = target
+                return returns
+        elif s_right is not None:
+            def l_fused_check(other):
+                if not compare(l_left(other), s_right):
+                    other.next_token = target
+                return returns
+        elif jump_if:
+            def l_fused_check(other):
+                if compare(l_left(other), l_right(other)):
+                    other.next_token = target
+                return returns
+        else:
+            def l_fused_check(other):
+                if not compare(l_left(other), l_right(other)):
+                    other.next_token = target
+                return returns
+        return l_fused_check
+
+    def _for_tail(self, code, pointer, end, increment, body, exit):
+        variable = self.variable(pointer)
+        s_increment = constant(increment)
+        if variable is None or s_increment is None:
+            return None
+
+        s_address, get_var, set_var = variable
+        s_end = constant(end)
+        l_end = self.interpreter.flatten(code, end)
+
+        if s_end is not None:
+            def l_fused_for(other):
+                set_var(s_address, get_var(s_address) + s_increment)
+                if get_var(s_address) > s_end:
+                    other.next_token = exit
+                else:
+                    other.next_token = body
+        else:
+            def l_fused_for(other):
+                set_var(s_address, get_var(s_address) + s_increment)
+                if get_var(s_address) > l_end(other):
+                    other.next_token = exit
+                else:
+                    other.next_token = body
+        return l_fused_for
+
+
+def report(code):
+    """Returns a summary of which patterns were fused, and how often each
+    fused closure ran (if the code was compiled with profiling on)."""
+    output = ['Fused patterns:']
+    if not code.fusions:
+        output.append('  (none)')
+    for pattern, stats in sorted(code.fusions.items()):
+        output.append('  {0:<14} {1:>5} sites {2:>10} hits'.format(
+            pattern, stats['sites'], stats['hits'][0]))
+    return '\n'.join(output)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+## Program modules ##
+import axe.parser
+import axe.peephole
+
+a = """
+Keeps the variables A to Z and theta in a Python list while a program runs,
+instead of in the calculator's memory.
+
+Reading 'A' from memory takes two lookups and some arithmetic; reading it from
+the list takes one.  The list is the real value of each variable while the
+program runs, and the copy in memory is only brought up to date when
+something might look at it:
+
+*   a pointer whose address isn't fixed, or which covers part of a variable
+    (like '{oA+1}') reads or writes memory directly, and the variables it
+    overlaps are written to memory first and read back afterwards (see
+    'Registers.get_var_1' and friends).
+*   a drawing command whose buffer might overlap the variables does the same
+    for all of them.
+*   'DispGraph' and the end of a run write them all to memory, so that
+    anything else watching memory (for example, through '--memory-file')
+    sees the current values.
+
+Every run reads them back from memory first, since memory may have changed in
+between.
+"""
+
+# Where the variables are, and how many there are (A to Z, and theta).
+BASE = axe.parser.Pointer.constants['AZ_VARS']
+COUNT = 27
+END = BASE + COUNT * 2
+
+# How much memory a drawing command can touch, starting from its buffer.
+BUFFER_SIZE = 768
+
+# Drawing commands, and the attributes holding their buffers.
+DRAWING = ('pxl_on', 'pxl_off', 'pxl_change', 'pxl_test', 'rect', 'recti',
+           'circle', 'draw_line', 'drawinv', 'dispgraph', 'clrdraw',
+           'horizontal', 'vertical')
+
+
+def index(address, size):
+    """Returns which variable the pointer ('address', 'size') is, or None if
+    it isn't exactly one of them."""
+    if address is None or size != 2:
+        return None
+    offset = address - BASE
+    if offset % 2 or not 0 <= offset < COUNT * 2:
+        return None
+    return offset // 2
+
+def overlaps(address, size):
+    """Returns True if 'size' bytes from 'address' might touch a variable.
+    An address of None (one that isn't known ahead of time) always might."""
+    if address is None:
+        return True
+    return BASE - size < address < END
+
+def buffers(ast):
+    """Returns the address nodes of every buffer a drawing command uses."""
+    output = []
+    for pointer in (getattr(ast, 'buf', None),
+                    getattr(ast, 'kwargs', {}).get('backbuffer')):
+        if pointer is not None:
+            output.append(pointer.address)
+    if ast.name in ('horizontal', 'vertical'):
+        output.append(ast.children[1].address)
+    return output
+
+def used(ast):
+    """
+    Returns a list of the variables 'ast' might read or write through 
+    memory, or None if that could be any of them (because it uses a pointer
+    whose address isn't fixed, for example).
+    """
+    output = set()
+    for node in axe.parser.nodes(ast):
+        if node.name in DRAWING:
+            for address in buffers(node):
+                if overlaps(axe.peephole.constant(address), BUFFER_SIZE):
+                    return None
+        if node.name != 'pointer':
+            continue
+        address = axe.peephole.constant(node.address)
+        if index(address, node.size) is not None:
+            output.add(index(address, node.size))
+        elif overlaps(address, node.size):
+            return None
+    return sorted(output)
+
+
+class Registers(object):
+    """
+    The variables A to Z and theta, for one calculator.
+
+    'bindings' is the Interpreter's Bindings object (see
+    'axe/interpreter.py'), which is how memory is reached.
+
+    'values' is the list the compiled code reads and writes directly.  It's
+    never replaced, only updated in place, so closures can hold on to it.
+    """
+    def __init__(self, bindings):
+        self.bindings = bindings
+        self.values = [0] * COUNT
+        return
+
+    def load(self, indices=None):
+        """Reads every variable (or just the ones in 'indices') from 
+        memory."""
+        get_var_2 = self.bindings.get_var_2
+        if indices is None:
+            self.values[:] = [get_var_2(BASE + 2 * i) for i in range(COUNT)]
+            return
+        for i in indices:
+            self.values[i] = get_var_2(BASE + 2 * i)
+        return
+
+    def store(self, indices=None):
+        """Writes every variable (or just the ones in 'indices') to 
+        memory."""
+        set_var_2 = self.bindings.set_var_2
+        if indices is None:
+            for i, value in enumerate(self.values):
+                set_var_2(BASE + 2 * i, value)
+            return
+        for i in indices:
+            set_var_2(BASE + 2 * i, self.values[i])
+        return
+
+    def _span(self, address, size):
+        if not BASE - size < address < END:
+            return ()
+        first = max((address - BASE) // 2, 0)
+        last = min((address + size - 1 - BASE) // 2, COUNT - 1)
+        return range(first, last + 1)
+
+    ## Memory access for any address ##
+
+    # These work like the methods of the same name on the calculator, but
+    # keep memory and the variables in step if the address overlaps them.
+
+    def get_var_1(self, address):
+        if BASE - 1 < address < END:
+            self.store(self._span(address, 1))
+        return self.bindings.get_var_1(address)
+
+    def get_var_2(self, address):
+        if BASE - 2 < address < END:
+            self.store(self._span(address, 2))
+        return self.bindings.get_var_2(address)
+
+    def set_var_1(self, address, value):
+        if not BASE - 1 < address < END:
+            return self.bindings.set_var_1(address, value)
+        span = self._span(address, 1)
+        self.store(span)
+        output = self.bindings.set_var_1(address, value)
+        self.load(span)
+        return output
+
+    def set_var_2(self, address, value):
+        if not BASE - 2 < address < END:
+            return self.bindings.set_var_2(address, value)
+        span = self._span(address, 2)
+        self.store(span)
+        output = self.bindings.set_var_2(address, value)
+        self.load(span)
+        return output
+
+    ## Closures ##
+
+    def accessors(self, address, size):
+        """
+        Returns the fastest (get_var, set_var) pair for a pointer, with the
+        same signatures as the calculator's get_var_2 and set_var_2.
+
+        'address' is the address of the pointer if it's known ahead of time,
+        or None otherwise.
+        """
+        s_index = index(address, size)
+        if s_index is not None:
+            s_values = self.values
+            def get_register(address):
+                return s_values[s_index]
+            def set_register(address, value):
+                value = value % 65536
+                s_values[s_index] = value
+                return value
+            return get_register, set_register
+
+        if overlaps(address, size):
+            source = self
+        else:
+            source = self.bindings
+        if size == 1:
+            return source.get_var_1, source.set_var_1
+        return source.get_var_2, source.set_var_2
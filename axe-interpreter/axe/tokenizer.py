@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+## System modules ##
+import re
+import types
+
+## 3rd party modules ##
+import ply.lex
+
+## Program modules ##
+import axe.lexer
+
+a = """
+A faster replacement for the lexer which ply builds from 'axe/lexer.py'.
+
+The rules in 'axe/lexer.py' are still what defines the language.  This
+module combines them into a single regex, in the same order ply tries them,
+and then turns every match into a token directly instead of calling one
+function per token.  The tokens (their types, values, line numbers and
+positions) are the same as the ones ply's lexer returns, and a Tokenizer can
+be passed to the parser wherever a ply lexer can.
+
+A Tokenizer can also read a program from a file a chunk at a time (see
+'Tokenizer.input_file'), so that large programs are never held in memory all
+at once.  Since no token except a block comment or a run of newlines ever
+goes past the end of a line, each chunk is split at the start of its last
+run of newlines, and the rest is kept for the next one.  If a block comment
+might still be open where a chunk ends, everything from its start is kept
+instead.
+"""
+
+# How much of a file is read at a time.
+CHUNK_SIZE = 64 * 1024
+
+# What the function rules in 'axe/lexer.py' set the value of a token to,
+# if it isn't the name of the token.  Tokens from string rules keep the text
+# they matched.
+VALUES = {
+    'COLON': 'NEWLINE',
+}
+
+# The rules which need more than a constant value.
+SPECIAL = ('NUMBER', 'NEWLINE', 'VAR', 'CONST', 'ID', 'COMMENT')
+
+# Turns '(...)' into '(?:...)', so that the only groups in the combined
+# regex are the named ones around each rule.
+_CAPTURING_GROUP = re.compile(r'(?<!\\)\((?!\?)')
+
+
+def rules(module=axe.lexer):
+    """
+    Returns a list of (token type, regex, is_function) for every rule in
+    'module', in the order ply tries them: functions in the order they're
+    defined, then strings from longest to shortest regex.
+    """
+    functions = []
+    strings = []
+    for name in dir(module):
+        if not name.startswith('t_') or name in ('t_ignore', 't_error'):
+            continue
+        rule = getattr(module, name)
+        if isinstance(rule, types.FunctionType):
+            functions.append((rule.func_code.co_firstlineno, name[2:], rule.__doc__))
+        else:
+            strings.append((name[2:], rule))
+    functions.sort()
+    strings.sort(key=lambda (kind, regex): len(regex), reverse=True)
+    return ([(kind, regex, True) for (line, kind, regex) in functions] +
+            [(kind, regex, False) for (kind, regex) in strings])
+
+
+def master_regex(module=axe.lexer):
+    """
+    Returns the single regex which matches any token.  Besides one group per
+    rule, it also has an '_ignore' group for whitespace, and an '_error' group
+    which matches any one character nothing else did.
+    """
+    parts = ['(?P<_ignore>[{0}]+)'.format(re.escape(module.t_ignore))]
+    for kind, regex, is_function in rules(module):
+        regex = _CAPTURING_GROUP.sub('(?:', regex)
+        parts.append('(?P<{0}>{1})'.format(kind, regex))
+    parts.append(r'(?P<_error>[\s\S])')
+    return re.compile('|'.join(parts), re.VERBOSE)
+
+
+class Tokenizer(object):
+    """
+    Splits a string into tokens.
+
+    This has the same interface as the lexers ply makes (at least, as much of
+    it as the parser uses): call 'input' with the text, then 'token'
+    repeatedly until it returns None.  Tokenizers can also be iterated over.
+
+    Like ply's lexers, 'lineno' carries on counting from where the previous
+    input left off.
+    """
+    def __init__(self, module=axe.lexer):
+        self.module = module
+        self.regex = master_regex(module)
+        # The rules whose tokens always have the same value.
+        self.constants = dict(
+            (kind, VALUES.get(kind, kind)) for (kind, regex, is_function) 
+            in rules(module) if is_function and kind not in SPECIAL)
+        self.lineno = 1
+        self.lexdata = ''
+        self._tokens = iter(())
+        self._stop = 0
+        return
+
+    def input(self, data):
+        self.lexdata = data
+        self._tokens = self.tokenize(data)
+        return
+
+    def input_file(self, source, chunk_size=CHUNK_SIZE):
+        """
+        Like 'input', but the text is read from the file object 'source' as
+        the tokens are needed.
+        
+        As with the text given to the interpreter, a newline is added to the
+        end if the file doesn't already end with one (or a colon).
+        """
+        self.lexdata = ''
+        self._tokens = self.tokenize_file(source, chunk_size)
+        return
+
+    def token(self):
+        return next(self._tokens, None)
+
+    def __iter__(self):
+        return self._tokens
+
+    def tokenize_file(self, source, chunk_size=CHUNK_SIZE):
+        """Yields the tokens in the file object 'source', one at a time."""
+        buffer = ''
+        offset = 0
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+            cut = split_point(buffer)
+            if not cut:
+                continue
+            for tok in self.tokenize(buffer[:cut], offset, final=False):
+                yield tok
+            offset += self._stop
+            buffer = buffer[self._stop:]
+        if buffer and buffer[-1] not in ('\n', ':'):
+            buffer += '\n'
+        for tok in self.tokenize(buffer, offset):
+            yield tok
+        return
+
+    def tokenize(self, data, offset=0, final=True):
+        """
+        Yields the tokens in 'data', one at a time.  'offset' is added to the
+        position of every token.
+        
+        If 'final' is False, more text follows 'data', so this stops before
+        any '...' which might start a block comment that ends later on.  
+        Afterwards, self._stop is the position in 'data' it stopped at.
+        """
+        constants = self.constants
+        reserved = self.module.reserved
+        LexToken = ply.lex.LexToken
+        lineno = self.lineno
+        self._stop = len(data)
+        for match in self.regex.finditer(data):
+            kind = match.lastgroup
+            if kind in constants:
+                value = constants[kind]
+            elif kind == '_ignore':
+                continue
+            elif kind == 'COMMENT':
+                value = match.group()
+                end = match.end()
+                if (not final and value == '...' and 
+                        (end == len(data) or data[end] == '\n')):
+                    self._stop = match.start()
+                    return
+                if '\n' in value:
+                    lineno += value.count('\n')
+                    self.lineno = lineno
+                continue
+            elif kind == '_error':
+                self.error(data, match.start())
+                continue
+            else:
+                value = match.group()
+                if kind == 'NUMBER':
+                    value = int(value)
+                elif kind == 'ID':
+                    kind = reserved.get(value, 'ID')
+                    if kind == 'ID' and len(value) <= 8:
+                        kind = 'NAME'
+                elif kind == 'VAR':
+                    value = 'VAR_' + value
+                elif kind == 'CONST':
+                    value = 'CONST_' + value
+                elif kind == 'NEWLINE':
+                    # Tokens get the line number from before the newlines.
+                    tok = LexToken()
+                    tok.type = kind
+                    tok.value = 'NEWLINE'
+                    tok.lineno = lineno
+                    tok.lexpos = match.start() + offset
+                    lineno += len(value)
+                    self.lineno = lineno
+                    yield tok
+                    continue
+
+            tok = LexToken()
+            tok.type = kind
+            tok.value = value
+            tok.lineno = lineno
+            tok.lexpos = match.start() + offset
+            yield tok
+        return
+
+    def error(self, data, position):
+        # Unlike ply's lexer, the column is counted from the start of the
+        # line, instead of from the rest of the text.
+        error_str = "! > Unrecognized token.  Lineno {lineno}, column {column}.  Token: '{token}'"
+        last_cr = data.rfind('\n', 0, position)
+        if last_cr < 0:
+            last_cr = 0
+        info = {'lineno': self.lineno,
+                'column': (position - last_cr) + 1,
+                'token': data[position:]}
+        print error_str.format(**info)
+        return
+
+
+def split_point(text):
+    """
+    Returns where 'text' can be split so that both halves can be lexed
+    separately (ignoring block comments): the start of the last run of
+    newlines.  Returns 0 if there isn't anywhere.
+    """
+    cut = text.rfind('\n')
+    while cut > 0 and text[cut - 1] == '\n':
+        cut -= 1
+    return max(cut, 0)
+
+
+def build():
+    return Tokenizer()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Axe Interpreter
+
+An interpreter for programs written in the Axe Parser language for computers.
+
+Author: Michael Lee (<michael.lee.0x2a@gmail.com>)
+License: GNU Lesser GPL
+"""
+
+from __future__ import print_function
+import sys
+import time
+import StringIO
+
+## Project Modules ##
+import axe
+import axe.tokenizer
+
+a = """
+Micro-benchmarks for the interpreter.
+
+Run as
+
+    $ python axe-interpreter/benchmark.py
+    $ python axe-interpreter/benchmark.py arithmetic --backend bytecode
+
+to print the best time out of several runs for each program.  To compare
+how quickly ply's lexer and the tokenizer in 'axe/tokenizer.py' split up a
+large program (each program copied many times over), run
+
+    $ python axe-interpreter/benchmark.py --lex
+"""
+
+PROGRAMS = {
+    'arithmetic': """
+.ARITH
+0->B
+For(A,0,200)
+    For(C,0,100)
+        A+B+C->B
+        B*3-A+C/2->D
+    End
+End
+""",
+    'nested_for': """
+.AA
+0->B
+For(A,0,2000)
+    For(C,0,100)
+        A->B
+    End
+End
+""",
+}
+
+
+def make_calculator():
+    """A calculator with memory, but without opening a window."""
+    calculator = axe.calculator.HeadlessCalculator()
+    calculator.init()
+    return calculator
+
+
+def time_program(text, backend='closure', repeat=3):
+    """
+    Returns the best wall-clock time, in seconds, that it took to run the
+    program out of 'repeat' tries.  Parsing isn't included.
+    """
+    lexer = axe.lexer.build()
+    parser = axe.parser.build()
+    ast = axe.optimizer.optimize(parser.parse(text, lexer=lexer))
+
+    best = None
+    for i in xrange(repeat):
+        interpreter = axe.backends[backend](make_calculator())
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            start = time.time()
+            interpreter.execute(ast)
+            elapsed = time.time() - start
+        finally:
+            sys.stdout = stdout
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+LEXERS = {
+    'ply': axe.lexer.build,
+    'tokenizer': axe.tokenizer.build
+}
+
+
+def time_lexer(text, build, repeat=3):
+    """
+    Returns the best wall-clock time, in seconds, that it took for a lexer
+    made by 'build' to turn all of the text into tokens.
+    """
+    lexer = build()
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        lexer.input(text)
+        token = lexer.token
+        while token():
+            pass
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(args=None):
+    import argparse
+    argparser = argparse.ArgumentParser(description='Axe benchmarks')
+    argparser.add_argument(
+        'programs', nargs='*',
+        help='Which programs to time (default: all of them).  One of: ' + 
+            ', '.join(sorted(PROGRAMS.keys())))
+    argparser.add_argument(
+        '-b', '--backend', action='append', choices=sorted(axe.backends),
+        help='Which backends to time (default: all of them).')
+    argparser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='How many times to run each program.')
+    argparser.add_argument(
+        '-l', '--lex', action='store_true',
+        help='Time the lexers instead of running the programs.')
+    argparser.add_argument(
+        '-c', '--copies', type=int, default=500,
+        help='How many copies of each program to lex at once.')
+    options = argparser.parse_args(args)
+
+    programs = options.programs or sorted(PROGRAMS.keys())
+    for name in programs:
+        if name not in PROGRAMS:
+            argparser.error('unknown program: ' + name)
+    if options.lex:
+        for name in programs:
+            text = PROGRAMS[name] * options.copies
+            for lexer in sorted(LEXERS):
+                elapsed = time_lexer(text, LEXERS[lexer], options.repeat)
+                print('{0:<12} {1:<10} {2:8.4f}s {3:10.0f} bytes/s'.format(
+                    name, lexer, elapsed, len(text) / elapsed))
+        return
+    backends = options.backend or sorted(axe.backends.keys())
+    for name in programs:
+        for backend in backends:
+            elapsed = time_program(PROGRAMS[name], backend, options.repeat)
+            print('{0:<12} {1:<10} {2:8.4f}s'.format(name, backend, elapsed))
+    return
+
+if __name__ == '__main__':
+    main()
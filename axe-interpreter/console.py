@@ -81,6 +81,53 @@ class CommandIo():
             help='Test specific components of this program.',
             dest='test'
         )
+        self._parser.add_argument(
+            '-b', '--backend',
+            action='store',
+            default='closure',
+            type=str,
+            choices=['closure', 'bytecode', 'python'],
+            help='Choose how the interpreter executes programs.',
+            dest='backend'
+        )
+        self._parser.add_argument(
+            '-p', '--profile',
+            action='store_true',
+            default=False,
+            help='Report which superinstructions fired after each run.',
+            dest='profile'
+        )
+        self._parser.add_argument(
+            '-d', '--dither',
+            action='store_true',
+            default=False,
+            help='Show grayscale by flickering, like a real calculator.',
+            dest='dither'
+        )
+        self._parser.add_argument(
+            '-m', '--memory-file',
+            action='store',
+            default=None,
+            type=str,
+            help='Keep the calculator\'s memory in this file, so other ' + 
+                'programs can watch it.',
+            dest='memory_file'
+        )
+        self._parser.add_argument(
+            '--headless',
+            action='store_true',
+            default=False,
+            help='Run without opening a window.',
+            dest='headless'
+        )
+        self._parser.add_argument(
+            '--no-cache',
+            action='store_true',
+            default=False,
+            help='Always parse the program, instead of reusing the ' + 
+                'result from an earlier run.',
+            dest='no_cache'
+        )
         return
     
     def parse(self, arguments=None):